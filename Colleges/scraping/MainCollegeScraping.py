@@ -1,13 +1,27 @@
+import os
+import sys
 import scrapy
 from w3lib.html import remove_tags_with_content
 from scrapy import Request
 
+# The shared crawling package lives at the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from crawling.aggregator import RecordAggregator
+from crawling.httpcache import HTTP_CACHE_SETTINGS
+
 class CombinedCollegesSpider(scrapy.Spider):
     name = 'combined_colleges_spider'
     allowed_domains = ['collegedekho.com']
     start_urls = ['https://www.collegedekho.com/engineering/colleges-in-india/']
 
+    # Pages are cached and revalidated with conditional requests. A college is
+    # built from several tab pages, so unchanged pages are still parsed, from
+    # the cache, rather than skipped. With -s DB_PIPELINE_ENABLED=True the
+    # colleges go straight into onlyedudb.
     custom_settings = {
+        **HTTP_CACHE_SETTINGS,
+        'ITEM_PIPELINES': {'crawling.database.DatabasePipeline': 400},
+        'DB_ENTITY': 'college',
         "CLOSESPIDER_ITEMCOUNT": None,
         "CLOSESPIDER_PAGECOUNT": None,
         'DOWNLOAD_DELAY': 0,
@@ -20,7 +34,11 @@ class CombinedCollegesSpider(scrapy.Spider):
     }
 
 
-    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Colleges whose tab pages are still being crawled, by college page url
+        self.colleges = RecordAggregator()
+
     def start_requests(self):
         yield scrapy.Request(self.start_urls[0], callback=self.parse, meta={'page': 1})
 
@@ -109,31 +127,54 @@ class CombinedCollegesSpider(scrapy.Spider):
 
     def parse_college_page(self, response):
         college_data = response.meta['college_data']
-
-        # Extract overview tab content
-        college_data['overviewTab'] = self.extract_overview_tab(response)
-        
-        # Extract highlights
-        college_data['highlights'] = self.extract_highlights(response)
-        
-        # Extract courses
-        college_data['courses'] = self.extract_courses(response)
-        
-        # Extract FAQs
-        college_data['faqs'] = self.extract_faqs(response)
-
-        # Extract and follow sub-navigation tabs
-        nav_tabs = response.css('.container.mobileContainerNone ul li a')
-        for tab in nav_tabs:
-            tab_title = tab.css('::text').get().strip()
-            tab_url = tab.css('::attr(href)').get()
-
-            if tab_title not in ['Gallery', 'Reviews', 'News', 'QnA']:
-                yield response.follow(
-                    tab_url, 
-                    self.parse_tab_content, 
-                    meta={'college_data': college_data, 'tab_title': tab_title}
-                )
+        college_key = response.url
+        # A college listed twice is crawled once; opening it again would drop
+        # the tabs already merged into the first record
+        if college_key in self.colleges:
+            self.logger.debug(f"Already crawling {college_key}")
+            return
+        self.colleges.open(college_key, college_data)
+
+        try:
+            # Extract overview tab content
+            college_data['overviewTab'] = self.extract_overview_tab(response)
+
+            # Extract highlights
+            college_data['highlights'] = self.extract_highlights(response)
+
+            # Extract courses
+            college_data['courses'] = self.extract_courses(response)
+
+            # Extract FAQs
+            college_data['faqs'] = self.extract_faqs(response)
+
+            # Extract and follow sub-navigation tabs
+            nav_tabs = response.css('.container.mobileContainerNone ul li a')
+            for tab in nav_tabs:
+                tab_title = tab.css('::text').get().strip()
+                tab_url = tab.css('::attr(href)').get()
+                if tab_url and tab_title not in ['Gallery', 'Reviews', 'News', 'QnA']:
+                    tab_url = response.urljoin(tab_url)
+                    # Every tab is counted until it is parsed or fails, and is
+                    # requested as soon as it is counted, so a later tab that
+                    # fails to parse cannot leave it counted but never sent.
+                    # Tabs are requested once per college by the aggregator,
+                    # so the duplicate filter must not drop one without a
+                    # callback.
+                    if self.colleges.expect(college_key, tab_url):
+                        yield scrapy.Request(
+                            tab_url,
+                            self.parse_tab_content,
+                            errback=self.tab_failed,
+                            dont_filter=True,
+                            meta={'college_key': college_key, 'tab_title': tab_title}
+                        )
+        finally:
+            # The college page itself is done, even if it failed to parse; a
+            # college without tabs is complete now
+            college = self.colleges.done(college_key)
+            if college:
+                yield college
 
     def extract_overview_tab(self, response):
         overview_tab = []
@@ -195,48 +236,77 @@ class CombinedCollegesSpider(scrapy.Spider):
         return faqs
 
     def parse_tab_content(self, response):
-        college_data = response.meta['college_data']
+        college_key = response.meta['college_key']
+        college_data = self.colleges.get(college_key)
         tab_title = response.meta['tab_title']
-        
-        tab_key = f"{tab_title.replace(' ', '').lower()}Tab"
-        tab_data = {'tab': tab_title, 'content': []}
-
-        blocks = response.css('.block.box')
-        for block in blocks:
-            title = self.safe_extract(block, 'h2::text')
-            content = block.xpath(
-                './/div[contains(@class, "collegeDetail_classRead__yd_kT")]/span[contains(@class, "collegeDetail_overview__Qr159")]/*'
-                '| .//div[contains(@class, "collegeDetail_classRead__yd_kT")]/*'
-            ).getall()
-            
-            content = [remove_tags_with_content(c, which_ones=('a',)) for c in content]
-            content_html = ''.join(content).strip()
-            
-            if title and content_html and not any(item['title'] == title for item in tab_data['content']):
-                tab_data['content'].append({
-                    'title': title,
-                    'content': content_html
-                })
 
-        if 'campus' in tab_title.lower():
-            facilities = self.extract_facilities(response)
-            if facilities:
-                tab_data['facilities'] = facilities
-
-        college_data[tab_key] = tab_data
-
-        # If this is the last tab, yield the complete college data
-        if tab_title == "CutOffs":  # Assuming "CutOffs" is the last tab before excluded ones
-            yield college_data
-
-        # Handle pagination within tabs if present
-        next_page = response.css('.loadMore_loadMoreBlock__PH_zn span::text').get()
-        if next_page:
-            yield response.follow(
-                next_page, 
-                self.parse_tab_content, 
-                meta={'college_data': college_data, 'tab_title': tab_title}
-            )
+        try:
+            tab_key = f"{tab_title.replace(' ', '').lower()}Tab"
+            tab_data = {'tab': tab_title, 'content': []}
+
+            blocks = response.css('.block.box')
+            for block in blocks:
+                title = self.safe_extract(block, 'h2::text')
+                content = block.xpath(
+                    './/div[contains(@class, "collegeDetail_classRead__yd_kT")]/span[contains(@class, "collegeDetail_overview__Qr159")]/*'
+                    '| .//div[contains(@class, "collegeDetail_classRead__yd_kT")]/*'
+                ).getall()
+
+                content = [remove_tags_with_content(c, which_ones=('a',)) for c in content]
+                content_html = ''.join(content).strip()
+
+                if title and content_html and not any(item['title'] == title for item in tab_data['content']):
+                    tab_data['content'].append({
+                        'title': title,
+                        'content': content_html
+                    })
+
+            if 'campus' in tab_title.lower():
+                facilities = self.extract_facilities(response)
+                if facilities:
+                    tab_data['facilities'] = facilities
+
+            # A further page of a tab adds to what its earlier pages found
+            existing = college_data.get(tab_key)
+            if existing:
+                titles = {item['title'] for item in existing['content']}
+                existing['content'].extend(item for item in tab_data['content'] if item['title'] not in titles)
+                if tab_data.get('facilities'):
+                    existing['facilities'] = existing.get('facilities', []) + tab_data['facilities']
+            else:
+                college_data[tab_key] = tab_data
+
+            # Handle pagination within tabs if present; the next page is counted too
+            next_page = response.css('.loadMore_loadMoreBlock__PH_zn span::text').get()
+            if next_page:
+                next_page_url = response.urljoin(next_page)
+                if self.colleges.expect(college_key, next_page_url):
+                    yield scrapy.Request(
+                        next_page_url,
+                        self.parse_tab_content,
+                        errback=self.tab_failed,
+                        dont_filter=True,
+                        meta={'college_key': college_key, 'tab_title': tab_title}
+                    )
+        finally:
+            # Yield the college once all of its tabs are in. A tab page that
+            # fails to parse is left out but still counts as done, like one
+            # that fails to download.
+            college = self.colleges.done(college_key)
+            if college:
+                yield college
+
+    # A tab that fails is left out, but still counts as done for its college
+    def tab_failed(self, failure):
+        meta = failure.request.meta
+        self.logger.warning(f"Failed to crawl the {meta['tab_title']} tab of {meta['college_key']}: {failure.value}")
+        college = self.colleges.done(meta['college_key'])
+        if college:
+            yield college
+
+    def closed(self, reason):
+        if len(self.colleges):
+            self.logger.warning(f"{len(self.colleges)} colleges were still waiting for tab pages and were not saved")
 
     def extract_facilities(self, response):
         facilities_section = response.css('.collegeDetail_facilities__wrgyU')
@@ -1,118 +1,189 @@
+import argparse
+import os
+import sys
 import psycopg2
-import json
-from datetime import datetime
-from slugify import slugify  # You can install python-slugify for generating slugs
-
-# Database connection
-conn = psycopg2.connect(
-    host="localhost",
-    database="onlyeducation",
-    user="postgres",
-    password="seaCalf"
-)
-cursor = conn.cursor()
-
-# Load the course JSON data
-with open('../course_data/courses.json', 'r', encoding='utf-8') as file:
-    course_data_list = json.load(file)  # Load list of courses
-
-
-# Function to check if a slug already exists in the database
-def check_slug_exists(slug):
-    query = "SELECT EXISTS(SELECT 1 FROM onlyedudb.coursees WHERE slug = %s);"
-    cursor.execute(query, (slug,))
-    return cursor.fetchone()[0]  # Returns True if the slug exists, False otherwise
-
-# Function to generate a unique slug
-def generate_unique_slug(title):
-    base_slug = slugify(title)
-    unique_slug = base_slug
-    count = 1
-    
-    # Check if the slug already exists and modify if necessary
-    while check_slug_exists(unique_slug):
-        unique_slug = f"{base_slug}-{count}"
-        count += 1
-
-    return unique_slug
-
-# Function to insert into the 'courses' table and return the generated course ID
-def insert_course(course_data):
-    query = """
-    INSERT INTO onlyedudb.coursees 
-    (title, slug, average_duration, average_fees, description, created_at, updated_at)
-    VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id;
-    """
-    
-    # Generate a unique slug for the course
-    slug = generate_unique_slug(course_data['title'])
-    
-    # Data mapping with None defaults
-    course = (
-        course_data.get('title', None),
-        slug,
-        course_data.get('average_duration', None),
-        course_data.get('average_fees', None),
-        course_data.get('description', None),
-        datetime.now(),
-        datetime.now()
-    )
-
-    cursor.execute(query, course)
-    course_id = cursor.fetchone()[0]
-    conn.commit()
-    return course_id
-
-
-# Insert into the 'coursees_components' table to link sections, FAQs, and other components
-def insert_course_components(course_id, course_data):
-    # Insert sections (this part is unchanged)
-    for section in course_data.get('sections', []):
-        query = """
-        INSERT INTO onlyedudb.components_course_compoents_sections (title, content)
-        VALUES (%s, %s) RETURNING id;
-        """
-        cursor.execute(query, (section.get('title', None), section.get('content', None)))
-        section_id = cursor.fetchone()[0]
-
-        # Link with course_components
-        link_query = """
-        INSERT INTO onlyedudb.coursees_components (entity_id, component_id, component_type, field)
-        VALUES (%s, %s, %s, %s);
-        """
-        cursor.execute(link_query, (course_id, section_id, 'section', 'sections'))
-
-    # Insert FAQs (new part)
-    insert_faqs(course_id, course_data.get('faqs', []))
-
-    conn.commit()
-
-    # Insert FAQs
-def insert_faqs(course_id, faqs):
-    for faq in faqs:
-        # Insert the FAQ into the components_exam_components_faqs table
-        query = """
-        INSERT INTO onlyedudb.components_exam_components_faqs (question, answer)
-        VALUES (%s, %s) RETURNING id;
-        """
-        cursor.execute(query, (faq.get('question', None), faq.get('answer', None)))
-        faq_id = cursor.fetchone()[0]
-
-        # Link the FAQ with the course in the coursees_components table
-        link_query = """
-        INSERT INTO onlyedudb.coursees_components (entity_id, component_id, component_type, field)
-        VALUES (%s, %s, %s, %s);
-        """
-        cursor.execute(link_query, (course_id, faq_id, 'global.faq', 'faq'))
-    
-    conn.commit()
-
-# Loop through the list of courses and insert the data for each one
-for course_data in course_data_list:
-    course_id = insert_course(course_data)
-    insert_course_components(course_id, course_data)
-
-# Close the cursor and connection
-cursor.close()
-conn.close()
-print("Course data migration completed successfully!")
+
+# The shared migration helpers live in the top-level migration directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'migration'))
+from slug_registry import SlugRegistry  # Needs python-slugify for generating slugs
+from component_dedup import MAX_ENTRIES, ComponentIndex
+from delta import DeltaIndex, record_key
+from entity_mapping import EntityWriter
+from id_allocator import BLOCK_SIZE, IdAllocator
+from json_stream import iter_json_array
+from mappings import COURSE_MAPPING
+from metrics import MigrationMetrics
+
+# Command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate scraped courses into onlyedudb")
+    parser.add_argument('--mode', choices=['insert', 'copy'], default='insert',
+                        help="insert: batched INSERT statements; copy: COPY the file through staging tables")
+    parser.add_argument('--delta', action='store_true',
+                        help="store a content hash per course and only rewrite new or changed courses (insert mode)")
+    parser.add_argument('--source', default='../course_data/courses.json',
+                        help="JSON array of scraped courses")
+    parser.add_argument('--id-block-size', type=int, default=BLOCK_SIZE,
+                        help="reserve ids from the sequences this many at a time and write a batch in one round trip; "
+                             "0 waits for RETURNING id instead")
+    parser.add_argument('--dedup', action='store_true',
+                        help="insert identical sections and FAQs once and link them from every course (insert mode)")
+    parser.add_argument('--dedup-entries', type=int, default=MAX_ENTRIES,
+                        help="component rows remembered for --dedup; older ones are inserted again when seen")
+    args = parser.parse_args(argv)
+    if args.delta and args.mode == 'copy':
+        parser.error("--delta rewrites single courses and only works with --mode insert")
+    if args.dedup and args.mode == 'copy':
+        parser.error("--dedup only works with --mode insert")
+    return args
+
+# Database connection details
+DB_CONFIG = {
+    'host': "localhost",
+    'database': "onlyeducation",
+    'user': "postgres",
+    'password': "seaCalf"
+}
+
+# Number of courses whose components are written and committed together
+BATCH_SIZE = 50
+
+# Connection, writer and lookups of the run in progress, set by migrate_courses
+conn = None
+writer = None
+delta = None
+metrics = None
+
+# Function to migrate one course in --delta mode: new courses are inserted,
+# unchanged ones skipped and for changed ones only the parts that differ are
+# rewritten. Returns 'new', 'unchanged' or 'changed'.
+def migrate_course_delta(course_data):
+    key = record_key(course_data['title'])
+    hashes = delta.part_hashes(COURSE_MAPPING, course_data)
+    status, course_id, changed = delta.classify(key, hashes)
+
+    if status == 'unchanged':
+        return status
+
+    timer = metrics.timer()
+    slug = None
+    try:
+        if status == 'new':
+            course_id, slug = writer.insert(course_data, timer)
+            writer.add_components(course_id, course_data, timer=timer)
+        else:
+            if 'entity' in changed:
+                writer.update(course_id, course_data, timer)
+            specs = [spec for spec in COURSE_MAPPING.components if spec.field in changed]
+            writer.delete_components(course_id, specs, timer)
+            writer.add_components(course_id, course_data, specs, timer)
+        writer.flush(timer)
+
+        delta_entry = delta.stage(writer.cursor, key, course_id, hashes)
+        with timer.phase('commit'):
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        writer.clear()
+        writer.release_slugs([slug])
+        raise
+    # The hashes only count once the course is committed
+    writer.confirm()
+    delta.confirm([delta_entry])
+    return status
+
+# Function to insert courses in batches of BATCH_SIZE: the course rows go in
+# one multi-row INSERT, then one INSERT per component type and one for the
+# links. Returns how many were inserted.
+def insert_courses(course_data_list):
+    course_count = 0
+    batch = []
+    for course_data in course_data_list:
+        batch.append(course_data)
+        if len(batch) == BATCH_SIZE:
+            insert_course_batch(batch)
+            course_count += len(batch)
+            batch = []
+    insert_course_batch(batch)
+    return course_count + len(batch)
+
+def insert_course_batch(batch):
+    if not batch:
+        return
+    timer = metrics.timer()
+    slugs = []
+    try:
+        inserted = writer.insert_many(batch, timer)
+        slugs = [slug for _, slug in inserted]
+        for course_data, (course_id, _) in zip(batch, inserted):
+            writer.add_components(course_id, course_data, timer=timer)
+        writer.flush(timer)
+        with timer.phase('commit'):
+            conn.commit()
+        writer.confirm()
+    except Exception:
+        conn.rollback()
+        writer.clear()
+        writer.release_slugs(slugs)
+        raise
+
+# Function to migrate a stream of courses on an open connection, committing
+# as it goes
+def migrate_courses(connection, course_data_list, mode='insert', use_delta=False, id_block_size=BLOCK_SIZE,
+                    dedup_entries=None):
+    global conn, writer, delta, metrics
+    conn = connection
+    cursor = conn.cursor()
+    metrics = MigrationMetrics()
+
+    # Every slug already in coursees, loaded once so new slugs need no lookups
+    slug_registry = SlugRegistry.load(cursor, COURSE_MAPPING.table)
+    # Ids are reserved from the sequences in blocks unless id_block_size is 0
+    id_allocator = IdAllocator(id_block_size) if id_block_size > 0 else None
+    # Identical components are shared between courses when dedup_entries is given
+    dedup = ComponentIndex(dedup_entries) if dedup_entries else None
+    writer = EntityWriter(cursor, COURSE_MAPPING, slug_registry, id_allocator, dedup)
+
+    # Content hashes of courses migrated by earlier --delta runs
+    delta = DeltaIndex(conn, 'course') if use_delta else None
+
+    if mode == 'copy':
+        # Stage every course and its components with COPY, then fan them out in one transaction
+        staged, slugs = writer.copy(course_data_list, timer=metrics.timer())
+        try:
+            conn.commit()
+        except Exception:
+            writer.release_slugs(slugs)
+            raise
+        course_count = len(staged)
+        print(f"Copied {course_count} courses")
+    elif use_delta:
+        counts = {'new': 0, 'unchanged': 0, 'changed': 0}
+        for course_data in course_data_list:
+            counts[migrate_course_delta(course_data)] += 1
+        course_count = counts['new'] + counts['changed']
+        print(f"New courses: {counts['new']}, unchanged: {counts['unchanged']}, changed: {counts['changed']}")
+    else:
+        course_count = insert_courses(course_data_list)
+
+    if dedup is not None:
+        print(f"Components linked instead of inserted again: {dedup.hits}")
+    metrics.report({'successful_migrations': course_count}, 'courses')
+    cursor.close()
+
+# Function to run the migration of the course file named on the command line
+def main(argv=None):
+    args = parse_args(argv)
+    connection = psycopg2.connect(**DB_CONFIG)
+
+    # Stream the course JSON data one course at a time
+    with open(args.source, 'r', encoding='utf-8') as course_file:
+        migrate_courses(connection, iter_json_array(course_file), args.mode, args.delta, args.id_block_size,
+                        args.dedup_entries if args.dedup else None)
+
+    connection.close()
+    print("Course data migration completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
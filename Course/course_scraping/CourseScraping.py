@@ -1,10 +1,26 @@
+import os
+import sys
 import scrapy
 
+# The shared crawling package lives at the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from crawling.httpcache import HTTP_CACHE_SETTINGS
+
 class CoursesSpider(scrapy.Spider):
     name = 'courses'
     allowed_domains = ['collegedekho.com']
     start_urls = ['https://www.collegedekho.com/courses/']
 
+    # Pages are cached and revalidated. With -s HTTPCACHE_SKIP_UNCHANGED=True
+    # courses whose page has not changed since the last crawl are not parsed
+    # or yielded again, so give such a crawl its own output file. With
+    # -s DB_PIPELINE_ENABLED=True the courses go straight into onlyedudb.
+    custom_settings = {
+        **HTTP_CACHE_SETTINGS,
+        'ITEM_PIPELINES': {'crawling.database.DatabasePipeline': 400},
+        'DB_ENTITY': 'course',
+    }
+
     def parse(self, response):
         # Parsing the list of courses
         courses = response.css('.course_list')
@@ -21,6 +37,7 @@ class CoursesSpider(scrapy.Spider):
                 'title': title,
                 'average_duration': average_duration,
                 'average_fees': average_fees,
+                'skip_unchanged': True,
             })
 
     def parse_course_details(self, response):
@@ -1,16 +1,70 @@
+import os
+import sys
 import scrapy
-import json
 import uuid
 
+# The shared crawling package lives at the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from crawling.httpcache import HTTP_CACHE_SETTINGS
+
+# careers360 subdomain of every exam stream and the id of that stream in
+# onlyedudb, as in STREAM_MAPPINGS of migration/MigrateExam2.py
+EXAM_STREAMS = {
+    'bschool': 3,
+    'competition': 16,
+    'design': 9,
+    'engineering': 1,
+    'finance': 17,
+    'it': 18,
+    'law': 10,
+    'media': 20,
+    'medicine': 2,
+    'pharmacy': 12,
+    'school': 19,
+    'studyabroad': 21,
+    'university': 22
+}
+
+# Crawls the exams of every stream in one run, all subdomains side by side:
+# scrapy runspider MainExamScrapingScript.py -a streams=law,engineering
+# Without streams it crawls all of EXAM_STREAMS.
 class Career360Spider(scrapy.Spider):
     name = 'career360'
-    allowed_domains = ['law.careers360.com']
-    start_urls = ['https://law.careers360.com/exams']
 
-    def __init__(self):
-        super().__init__()
-        # To store all exams in an array before writing to the file
-        self.exams_data = []
+    # Every exam is written to its stream's JSON Lines file as soon as it is
+    # parsed; the array-shaped files the migration reads are written from them
+    # at the end. Each subdomain is its own download slot, so raising the
+    # total limit lets every stream crawl at the per-domain limit at once.
+    # Pages are cached and revalidated. With -s HTTPCACHE_SKIP_UNCHANGED=True
+    # exams whose page has not changed since the last crawl are not parsed
+    # again, and only the changed ones go to *_changes files. With
+    # -s DB_PIPELINE_ENABLED=True the exams also go straight into onlyedudb,
+    # and -s JSONL_PATH= leaves out the files.
+    custom_settings = {
+        **HTTP_CACHE_SETTINGS,
+        'ITEM_PIPELINES': {
+            'crawling.pipelines.JsonLinesPipeline': 300,
+            'crawling.database.DatabasePipeline': 400,
+        },
+        'DB_ENTITY': 'exam',
+        'JSONL_PATH': '{stream}_exam_data.jsonl',
+        'JSONL_ARRAY_PATH': '{stream}_exam_data.json',
+        'CONCURRENT_REQUESTS': 8 * len(EXAM_STREAMS),
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 8,
+    }
+
+    def __init__(self, streams=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streams = streams.split(',') if streams else list(EXAM_STREAMS)
+        unknown = [stream for stream in self.streams if stream not in EXAM_STREAMS]
+        if unknown:
+            raise ValueError(f"Unknown streams: {', '.join(unknown)}")
+        self.allowed_domains = [f'{stream}.careers360.com' for stream in self.streams]
+        self.start_urls = [f'https://{stream}.careers360.com/exams' for stream in self.streams]
+
+    def start_requests(self):
+        for stream, url in zip(self.streams, self.start_urls):
+            yield scrapy.Request(url=url, callback=self.parse, meta={'stream': stream})
 
     def parse(self, response):
         exams = response.css('div.examListing_card')
@@ -43,12 +97,15 @@ class Career360Spider(scrapy.Spider):
                     'accepting_colleges': accepting_colleges or 'N/A',
                     'total_applications': total_applications or 'N/A',
                     'application_link': exam.css('div.group a::attr(href)').getall(),
+                    'stream': response.meta['stream'],
+                    'skip_unchanged': True,
                 }
             )
 
         next_page = response.css('a.pagination_list_last::attr(href)').get()
         if next_page:
-            yield scrapy.Request(url=response.urljoin(next_page), callback=self.parse)
+            yield scrapy.Request(url=response.urljoin(next_page), callback=self.parse,
+                                 meta={'stream': response.meta['stream']})
 
     def parse_exam_details(self, response):
         exam_id = str(uuid.uuid4())
@@ -62,6 +119,8 @@ class Career360Spider(scrapy.Spider):
             'accepting_colleges': response.meta['accepting_colleges'],
             'total_applications': response.meta['total_applications'],
             'application_link': response.meta['application_link'],
+            'stream': response.meta['stream'],
+            'stream_id': EXAM_STREAMS[response.meta['stream']],
         }
 
         exam_data['about_exam'] = {
@@ -177,13 +236,7 @@ class Career360Spider(scrapy.Spider):
             })
         exam_data['faqs'] = faq_list
 
-        # Append the data for this exam to the array of exams
-        self.exams_data.append(exam_data)
-
         self.log(f'Collected data for {exam_data["exam_name"]}')
 
-    def closed(self, reason):
-        # Write the full array of exams to the JSON file when the spider closes
-        with open('law_exam_data.json', 'w', encoding='utf-8') as f:
-            json.dump(self.exams_data, f, ensure_ascii=False, indent=4)
-        self.log('Saved all exam data to exams_data.json')
+        # Hand the exam to the pipeline, which writes it out straight away
+        yield exam_data
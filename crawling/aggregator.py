@@ -0,0 +1,47 @@
+# Assembles records that are scraped from several pages. A record is held
+# while requests for its pages are outstanding, counting the page that opened
+# it, and handed back exactly once, when the last of them has been answered or
+# has failed; it is then forgotten, so only records still being crawled are
+# kept in memory.
+class RecordAggregator:
+    def __init__(self):
+        # key -> [record, outstanding requests, urls requested for it]
+        self.records = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    # Function to tell whether a record is still being crawled
+    def __contains__(self, key):
+        return key in self.records
+
+    # Function to start a record. The page that opened it counts as
+    # outstanding until done is called for it as well.
+    def open(self, key, record):
+        self.records[key] = [record, 1, set()]
+
+    def get(self, key):
+        return self.records[key][0]
+
+    # Function to count one more outstanding request for a record. Returns
+    # False for a url already requested for it, which is not to be requested
+    # again, e.g. a "load more" link pointing back at the same page.
+    def expect(self, key, url):
+        state = self.records[key]
+        if url in state[2]:
+            return False
+        state[2].add(url)
+        state[1] += 1
+        return True
+
+    # Function to mark one request of a record as answered or failed. Returns
+    # the record once none are outstanding any more, otherwise None.
+    def done(self, key):
+        state = self.records.get(key)
+        if state is None:
+            return None
+        state[1] -= 1
+        if state[1] > 0:
+            return None
+        del self.records[key]
+        return state[0]
@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+from collections import defaultdict
+from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, task, threads
+
+# Items written and committed together, at most
+FLUSH_ITEMS = 50
+
+# Seconds an item waits for the rest of its batch, at most
+FLUSH_SECONDS = 10.0
+
+# Kinds of items the pipeline writes, by DB_ENTITY
+ENTITIES = ('exam', 'course', 'college')
+
+
+# Writes the items of a crawl straight into onlyedudb while it runs, with no
+# JSON file in between. Items are buffered and written in batches of
+# DB_FLUSH_ITEMS, or after DB_FLUSH_SECONDS if fewer arrive, through the same
+# writers as the migration scripts: exams through MigrateExam2's
+# ExamMigrator, so they get the same slugs, stream links and components and a
+# bad exam only fails itself; courses and colleges through CollegeLoader.
+#
+# The writes run on a thread of their own, one batch at a time, so the crawl
+# keeps downloading meanwhile. The item that fills a batch is only passed on
+# once the batch is written, which holds the spider back when the database
+# falls behind.
+#
+# Off unless DB_PIPELINE_ENABLED is set, e.g.
+# scrapy runspider MainExamScrapingScript.py -s DB_PIPELINE_ENABLED=True -s JSONL_PATH=
+# psycopg2 and the migration scripts are only imported then.
+#
+# Settings: DB_PIPELINE_ENABLED, DB_ENTITY ('exam', 'course' or 'college'),
+# DB_FLUSH_ITEMS, DB_FLUSH_SECONDS
+class DatabasePipeline:
+    def __init__(self, entity, flush_items=FLUSH_ITEMS, flush_seconds=FLUSH_SECONDS):
+        self.entity = entity
+        self.flush_items = flush_items
+        self.flush_seconds = flush_seconds
+        self.conn = None
+        self.loader = None
+        self.source = None
+        self.buffer = []
+        self.buffered_at = None
+        self.task = None
+        self.spider = None
+        # Lets one batch at a time reach the writer thread, in order
+        self.lock = defer.DeferredLock()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DB_PIPELINE_ENABLED'):
+            raise NotConfigured
+        entity = settings.get('DB_ENTITY')
+        if entity not in ENTITIES:
+            raise NotConfigured(f"DB_ENTITY must be one of {', '.join(ENTITIES)}")
+        return cls(
+            entity,
+            settings.getint('DB_FLUSH_ITEMS', FLUSH_ITEMS),
+            settings.getfloat('DB_FLUSH_SECONDS', FLUSH_SECONDS)
+        )
+
+    def open_spider(self, spider):
+        self.spider = spider
+        self.source = f'{spider.name} crawl'
+        opened = self.lock.run(threads.deferToThread, self.connect)
+        # Items of a crawl that has gone quiet are written on time as well
+        self.task = task.LoopingCall(self.flush_on_time)
+        opened.addCallback(self.start_timer)
+        return opened
+
+    # Function to start the timer once connected. Its Deferred only fires when
+    # the timer stops, so it is not chained to the opening.
+    def start_timer(self, _):
+        self.task.start(self.flush_seconds, now=False)
+
+    # Function to connect and build the writer, on the writer thread
+    def connect(self):
+        # The migration scripts live in the top-level migration directory
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migration'))
+        import psycopg2
+        import MigrateExam2
+        from id_allocator import IdAllocator
+        from mappings import COLLEGE_MAPPING, COURSE_MAPPING, EXAM_MAPPING
+        from MigrateColleges import CollegeLoader
+        from slug_registry import SlugRegistry
+
+        mapping = {'exam': EXAM_MAPPING, 'course': COURSE_MAPPING, 'college': COLLEGE_MAPPING}[self.entity]
+        self.conn = psycopg2.connect(**MigrateExam2.DB_CONFIG)
+
+        # Every slug already in the table, loaded once so new slugs need no lookups
+        with self.conn.cursor() as cursor:
+            slug_registry = SlugRegistry.load(cursor, mapping.table)
+        self.conn.commit()
+
+        if self.entity == 'exam':
+            self.loader = MigrateExam2.ExamMigrator(self.conn, slug_registry, self.flush_items,
+                                                    id_allocator=IdAllocator())
+        else:
+            self.loader = CollegeLoader(self.conn, slug_registry, 'insert', id_allocator=IdAllocator(),
+                                        mapping=mapping)
+
+    def process_item(self, item, spider):
+        if not self.buffer:
+            self.buffered_at = time.monotonic()
+        self.buffer.append(ItemAdapter(item).asdict())
+        written = self.flush_if_due()
+        if written is None:
+            return item
+        return written.addCallback(lambda _: item)
+
+    # Function to write the buffered items if there are enough of them or the
+    # oldest has waited long enough. Returns the Deferred of the write, if any.
+    def flush_if_due(self):
+        if not self.buffer:
+            return None
+        if len(self.buffer) >= self.flush_items or time.monotonic() - self.buffered_at >= self.flush_seconds:
+            return self.flush()
+        return None
+
+    # Function run by the timer. A batch that fails is logged, so the timer
+    # keeps going.
+    def flush_on_time(self):
+        written = self.flush_if_due()
+        if written is not None:
+            written.addErrback(lambda failure: self.spider.logger.error(f"Failed to write a batch: {failure.value}"))
+        return written
+
+    # Function to hand the buffered items to the writer thread. Returns a
+    # Deferred that fires once they are written and committed.
+    def flush(self):
+        records, self.buffer = self.buffer, []
+        return self.lock.run(threads.deferToThread, self.write, records)
+
+    # Function to write and commit a batch, on the writer thread
+    def write(self, records):
+        if not records:
+            return
+        if self.entity == 'exam':
+            from modify import restructure_exam
+            # Exams are written per stream, so each is linked to its own
+            streams = defaultdict(list)
+            for exam in records:
+                streams[exam['stream_id']].append(restructure_exam(exam))
+            for stream_id, exams in streams.items():
+                self.loader.migrate(iter(exams), self.source, stream_id, 'insert')
+        else:
+            self.loader.load(records, self.source, self.flush_items)
+
+    # Function to write what is left and close the connection, on the writer thread
+    def close(self, records):
+        try:
+            self.write(records)
+        finally:
+            stats = self.loader.stats
+            self.spider.log(f"Wrote {stats['successful_migrations']} {self.entity}s to the database, "
+                            f"{stats['failed_migrations']} failed")
+            self.loader.close()
+            self.conn.close()
+
+    def close_spider(self, spider):
+        if self.task.running:
+            self.task.stop()
+        records, self.buffer = self.buffer, []
+        return self.lock.run(threads.deferToThread, self.close, records)
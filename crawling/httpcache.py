@@ -0,0 +1,71 @@
+from scrapy.exceptions import IgnoreRequest
+from scrapy.extensions.httpcache import RFC2616Policy
+
+# Settings that turn on the cache for a spider; merge them into its
+# custom_settings. Pages are kept under .scrapy/httpcache/<spider name>.
+#
+# Every page is still parsed, from the cache when it has not changed, so the
+# output stays complete. -s HTTPCACHE_SKIP_UNCHANGED=True leaves unchanged
+# detail pages out for an incremental crawl; its output then holds only the
+# changed items, which JsonLinesPipeline writes to *_changes files instead.
+#
+# The cache doubles as an offline corpus: to parse every stored page again
+# without touching the network, run the spider with
+# -s HTTPCACHE_POLICY=scrapy.extensions.httpcache.DummyPolicy
+# -s HTTPCACHE_IGNORE_MISSING=True
+HTTP_CACHE_SETTINGS = {
+    'HTTPCACHE_ENABLED': True,
+    'HTTPCACHE_POLICY': 'crawling.httpcache.RevalidatePolicy',
+    'HTTPCACHE_EXPIRATION_SECS': 0,
+    'HTTPCACHE_GZIP': True,
+    # Below HttpCacheMiddleware (900), so it sees the responses the cache answered
+    'DOWNLOADER_MIDDLEWARES': {'crawling.httpcache.SkipUnchangedMiddleware': 850},
+}
+
+
+# Keeps every page the site sends and asks the site again on every crawl
+# whether it changed, with If-None-Match and If-Modified-Since from the stored
+# ETag and Last-Modified. A 304, or a 200 whose body is the one stored for
+# sites without validators, answers the request from the cache. Cache-Control
+# is ignored, as most pages forbid caching although they rarely change.
+class RevalidatePolicy(RFC2616Policy):
+    def should_cache_response(self, response, request):
+        return response.status == 200
+
+    # Function to add the validators of the stored page to the request; the
+    # stored page is never used without asking
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if b'ETag' in cachedresponse.headers:
+            request.headers[b'If-None-Match'] = cachedresponse.headers[b'ETag']
+        if b'Last-Modified' in cachedresponse.headers:
+            request.headers[b'If-Modified-Since'] = cachedresponse.headers[b'Last-Modified']
+        return False
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+        if response.status == 304:
+            return True
+        if response.status >= 500:
+            # The stored page stands in while the site is failing
+            return True
+        return response.status == 200 and response.body == cachedresponse.body
+
+
+# With HTTPCACHE_SKIP_UNCHANGED, drops the responses of requests marked with
+# meta 'skip_unchanged' when the cache answered them, i.e. the page is the
+# same as on the last crawl, so their callbacks do not parse it again. Only
+# mark pages whose items can be left out of an incremental crawl; listing
+# pages must still be parsed to find the pages that did change.
+class SkipUnchangedMiddleware:
+    def __init__(self, stats, enabled=False):
+        self.stats = stats
+        self.enabled = enabled
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats, crawler.settings.getbool('HTTPCACHE_SKIP_UNCHANGED'))
+
+    def process_response(self, request, response, spider):
+        if self.enabled and request.meta.get('skip_unchanged') and 'cached' in response.flags:
+            self.stats.inc_value('httpcache/unchanged_skipped', spider=spider)
+            raise IgnoreRequest(f"Unchanged since the last crawl: {response.url}")
+        return response
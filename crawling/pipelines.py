@@ -0,0 +1,138 @@
+import json
+import os
+import sys
+import time
+from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+# Items written between two flushes of the JSON Lines file, at most
+FLUSH_ITEMS = 20
+
+# Seconds between two flushes of the JSON Lines file, at most
+FLUSH_SECONDS = 5.0
+
+
+# Function to turn a JSON Lines file into the array-shaped file the migration
+# scripts read, one item at a time, so neither file is held in memory
+def jsonl_to_array(jsonl_path, array_path):
+    count = 0
+    with open(jsonl_path, 'r', encoding='utf-8') as source, open(array_path, 'w', encoding='utf-8') as target:
+        target.write('[')
+        for line in source:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            target.write(',\n' if count else '\n')
+            target.write(json.dumps(item, ensure_ascii=False, indent=4))
+            count += 1
+        target.write('\n]' if count else ']')
+    return count
+
+
+# Function to name the file of an incremental crawl after the full one, e.g.
+# law_exam_data_changes.jsonl for law_exam_data.jsonl
+def changes_path(path):
+    root, extension = os.path.splitext(path)
+    return f"{root}_changes{extension}"
+
+
+# Writes every item to a JSON Lines file as soon as the spider yields it, so
+# memory stays flat however long the crawl runs and a crash keeps every item
+# written before it. The files are flushed every JSONL_FLUSH_ITEMS items or
+# JSONL_FLUSH_SECONDS seconds, whichever comes first. When the spider closes,
+# the array-shaped JSONL_ARRAY_PATH files are written from them, if set.
+#
+# The paths may name item fields, e.g. '{stream}_exam_data.jsonl', to write
+# one partition per value; each partition's file is opened when its first
+# item arrives. A crawl that skips unchanged pages (HTTPCACHE_SKIP_UNCHANGED)
+# only yields the changed items, so it writes *_changes files and leaves the
+# full files of the last complete crawl alone.
+#
+# Settings: JSONL_PATH (an empty one turns the pipeline off), JSONL_ARRAY_PATH,
+# JSONL_FLUSH_ITEMS, JSONL_FLUSH_SECONDS
+class JsonLinesPipeline:
+    def __init__(self, path, array_path=None, flush_items=FLUSH_ITEMS, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.array_path = array_path
+        self.flush_items = flush_items
+        self.flush_seconds = flush_seconds
+        # JSON Lines path -> [open file, array path, items written]
+        self.partitions = {}
+        self.unflushed = 0
+        self.flushed_at = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        path = settings.get('JSONL_PATH')
+        if not path:
+            raise NotConfigured
+        array_path = settings.get('JSONL_ARRAY_PATH')
+        if settings.getbool('HTTPCACHE_SKIP_UNCHANGED'):
+            path = changes_path(path)
+            array_path = changes_path(array_path) if array_path else None
+        return cls(
+            path,
+            array_path,
+            settings.getint('JSONL_FLUSH_ITEMS', FLUSH_ITEMS),
+            settings.getfloat('JSONL_FLUSH_SECONDS', FLUSH_SECONDS)
+        )
+
+    def open_spider(self, spider):
+        self.flushed_at = time.monotonic()
+        # Items of a crawl that has gone quiet are pushed to disk on time as well
+        self.task = task.LoopingCall(self.flush_if_due)
+        self.task.start(self.flush_seconds, now=False)
+
+    # Function to get the partition an item goes to, opening its file the
+    # first time
+    def partition(self, fields):
+        path = self.path.format_map(fields)
+        partition = self.partitions.get(path)
+        if partition is None:
+            array_path = self.array_path.format_map(fields) if self.array_path else None
+            partition = [open(path, 'w', encoding='utf-8'), array_path, 0]
+            self.partitions[path] = partition
+        return partition
+
+    def process_item(self, item, spider):
+        fields = ItemAdapter(item).asdict()
+        partition = self.partition(fields)
+        partition[0].write(json.dumps(fields, ensure_ascii=False) + '\n')
+        partition[2] += 1
+        self.unflushed += 1
+        self.flush_if_due()
+        return item
+
+    # Function to flush if enough items were written or the last flush is old enough
+    def flush_if_due(self):
+        if not self.unflushed:
+            return
+        if self.unflushed >= self.flush_items or time.monotonic() - self.flushed_at >= self.flush_seconds:
+            self.flush()
+
+    # Function to push the written items of every partition to disk
+    def flush(self):
+        for file, _, _ in self.partitions.values():
+            file.flush()
+        self.unflushed = 0
+        self.flushed_at = time.monotonic()
+
+    def close_spider(self, spider):
+        if self.task.running:
+            self.task.stop()
+        for path, (file, array_path, count) in self.partitions.items():
+            file.close()
+            spider.log(f'Saved {count} items to {path}')
+            if array_path:
+                jsonl_to_array(path, array_path)
+                spider.log(f'Saved {count} items to {array_path}')
+
+
+# Converts the JSON Lines file of an interrupted crawl by hand:
+# python -m crawling.pipelines law_exam_data.jsonl law_exam_data.json
+if __name__ == '__main__':
+    count = jsonl_to_array(sys.argv[1], sys.argv[2])
+    print(f"Wrote {count} items to {sys.argv[2]}")
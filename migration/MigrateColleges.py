@@ -0,0 +1,204 @@
+import argparse
+import json
+import psycopg2
+from itertools import islice
+from entity_mapping import EntityWriter
+from id_allocator import BLOCK_SIZE, IdAllocator
+from json_stream import iter_json_records
+from mappings import COLLEGE_MAPPING
+from metrics import MigrationMetrics
+from slug_registry import SlugRegistry
+
+# Database connection details
+DB_CONFIG = {
+    'host': "localhost",
+    'database': "onlyeducation",
+    'user': "postgres",
+    'password': "seaCalf"
+}
+
+# Command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load CombinedCollegesSpider output into onlyedudb")
+    parser.add_argument('files', nargs='+',
+                        help="spider output files: JSON arrays, or JSON Lines when named .jl/.jsonl")
+    parser.add_argument('--mode', choices=['copy', 'insert'], default='copy',
+                        help="copy: COPY each batch through staging tables; insert: multi-row INSERTs per batch")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="colleges written and committed together")
+    parser.add_argument('--metrics', default=None,
+                        help="append per-batch and end-of-run phase timings to this JSON Lines file")
+    parser.add_argument('--id-block-size', type=int, default=BLOCK_SIZE,
+                        help="reserve ids from the sequences this many at a time and write an insert batch in one "
+                             "round trip; 0 waits for RETURNING id instead")
+    return parser.parse_args(argv)
+
+# Function to create an empty statistics dict
+def new_stats():
+    return {
+        'total_colleges': 0,
+        'successful_migrations': 0,
+        'failed_migrations': 0,
+        'successful_files': 0,
+        'failed_files': 0
+    }
+
+# Loads colleges in batches of --batch-size: every batch is one transaction
+# with a constant number of round trips, whatever the number of colleges,
+# tabs, courses and facilities in it. A batch that fails as a whole is
+# retried one college at a time, so one bad record only fails itself.
+# Other entities with the same shape of record, such as courses, are loaded
+# the same way by passing their mapping.
+class CollegeLoader:
+    def __init__(self, conn, slug_registry, mode='copy', metrics=None, id_allocator=None, mapping=COLLEGE_MAPPING):
+        self.conn = conn
+        self.mapping = mapping
+        self.cursor = conn.cursor()
+        self.mode = mode
+        self.metrics = metrics if metrics is not None else MigrationMetrics()
+        self.timer = self.metrics.timer()
+        self.stats = new_stats()
+        self.failed_colleges = []
+        # Writes colleges and their components as the mapping declares, with
+        # ids from the IdAllocator if there is one
+        self.writer = EntityWriter(self.cursor, mapping, slug_registry, id_allocator)
+
+    # Function to record a failed college in the statistics
+    def record_failure(self, source_file, college, error):
+        self.stats['failed_migrations'] += 1
+        self.failed_colleges.append({
+            'file': source_file,
+            'title': college.get('title'),
+            'error': str(error)
+        })
+        print(f"Failed to migrate {college.get('title')}: {str(error)}")
+
+    # Function to write one batch with multi-row INSERTs: one for the
+    # colleges, one per component type and one for the links. Returns the
+    # colleges written.
+    def insert_batch(self, batch, source_file):
+        colleges = []
+        for college in batch:
+            try:
+                # Rows are built up front as well, so a malformed college fails before any write
+                self.mapping.values(college, None)
+                for spec in self.mapping.components:
+                    spec.rows(college)
+            except Exception as e:
+                self.record_failure(source_file, college, e)
+                continue
+            colleges.append(college)
+        if not colleges:
+            return 0
+
+        slugs = []
+        try:
+            inserted = self.writer.insert_many(colleges, self.timer)
+            slugs = [slug for _, slug in inserted]
+            for college, (college_id, _) in zip(colleges, inserted):
+                self.writer.add_components(college_id, college, timer=self.timer)
+            self.writer.flush(self.timer)
+            with self.timer.phase('commit'):
+                self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.writer.clear()
+            self.writer.release_slugs(slugs)
+            if len(colleges) == 1:
+                self.record_failure(source_file, colleges[0], e)
+                return 0
+            return sum(self.insert_batch([college], source_file) for college in colleges)
+        return len(colleges)
+
+    # Function to write one batch with COPY through staging tables. A batch
+    # that fails is retried through insert_batch.
+    def copy_batch(self, batch, source_file):
+        failed = set()
+
+        def on_error(college, error):
+            failed.add(id(college))
+            self.record_failure(source_file, college, error)
+
+        slugs = []
+        try:
+            staged, slugs = self.writer.copy(batch, on_error=on_error, timer=self.timer)
+            with self.timer.phase('commit'):
+                self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.writer.release_slugs(slugs)
+            print(f"COPY of a batch from {source_file} failed, retrying it with INSERTs: {str(e)}")
+            return self.insert_batch([college for college in batch if id(college) not in failed], source_file)
+        return len(staged)
+
+    # Function to load a stream of colleges batch by batch
+    def load(self, colleges, source_file, batch_size):
+        colleges = iter(colleges)
+        while True:
+            self.timer = self.metrics.timer()
+            with self.timer.phase('parse'):
+                batch = list(islice(colleges, batch_size))
+            if not batch:
+                return
+            self.stats['total_colleges'] += len(batch)
+            if self.mode == 'copy':
+                loaded = self.copy_batch(batch, source_file)
+            else:
+                loaded = self.insert_batch(batch, source_file)
+            self.stats['successful_migrations'] += loaded
+            self.timer.emit('batch', file=source_file, colleges=len(batch), loaded=loaded)
+            print(f"Loaded {loaded} of {len(batch)} colleges from {source_file} "
+                  f"({self.stats['successful_migrations']} so far)")
+
+    def close(self):
+        self.cursor.close()
+
+# Function to load every file named on the command line
+def main(argv=None):
+    args = parse_args(argv)
+    conn = psycopg2.connect(**DB_CONFIG)
+
+    # Every slug already in colleges, loaded once so new slugs need no lookups
+    with conn.cursor() as slug_cursor:
+        slug_registry = SlugRegistry.load(slug_cursor, COLLEGE_MAPPING.table)
+    conn.commit()
+
+    metrics = MigrationMetrics(args.metrics)
+    id_allocator = IdAllocator(args.id_block_size) if args.id_block_size > 0 else None
+    loader = CollegeLoader(conn, slug_registry, args.mode, metrics, id_allocator)
+    try:
+        for source_file in args.files:
+            print(f"\nProcessing {source_file}")
+            try:
+                with open(source_file, 'r', encoding='utf-8') as file:
+                    loader.load(iter_json_records(file, source_file), source_file, args.batch_size)
+                loader.stats['successful_files'] += 1
+            except (OSError, json.JSONDecodeError) as e:
+                # Batches read before the error stay committed
+                loader.stats['failed_files'] += 1
+                print(f"Failed to read {source_file}: {str(e)}")
+    finally:
+        stats = loader.stats
+        print("\nCollege Migration Summary:")
+        print("=" * 50)
+        print(f"Successful files: {stats['successful_files']}")
+        print(f"Failed files: {stats['failed_files']}")
+        print(f"Total colleges processed: {stats['total_colleges']}")
+        print(f"Successful migrations: {stats['successful_migrations']}")
+        print(f"Failed migrations: {stats['failed_migrations']}")
+
+        if loader.failed_colleges:
+            print("\nFailed Colleges:")
+            for fail in loader.failed_colleges:
+                print(f"\nFile: {fail['file']}")
+                print(f"College: {fail['title']}")
+                print(f"Error: {fail['error']}")
+
+        metrics.report(stats, 'colleges')
+        metrics.close()
+        loader.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,25 @@
+import argparse
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.pool import ThreadedConnectionPool
 import json
-from slugify import slugify
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import BoundedSemaphore
+from bulk_indexes import BulkIndexes, mapping_tables
+from checkpoints import open_checkpoint_journal, source_id
+from component_dedup import MAX_ENTRIES, ComponentIndex
+from dead_letters import DeadLetterFile
+from delta import DeltaIndex, record_key
+from entity_mapping import EntityWriter
+from exam_groups import ExamGroups
+from id_allocator import BLOCK_SIZE, IdAllocator
+from json_stream import iter_json_array
+from mappings import EXAM_MAPPING
+from metrics import MigrationMetrics
+from modify import restructure_exams
+from slug_registry import SlugRegistry
+from transactions import TransactionPolicy
 
 # Define the stream mappings
 STREAM_MAPPINGS = {
@@ -21,239 +38,633 @@ STREAM_MAPPINGS = {
     '../Exams/exams_data/university_exam_data.json': 22
 }
 
+# Command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate scraped exams into onlyedudb")
+    parser.add_argument('--mode', choices=['insert', 'copy'], default='insert',
+                        help="insert: batched INSERT statements per exam; copy: COPY each file through staging tables")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of pooled connections migrating stream files in parallel")
+    parser.add_argument('--chunk-size', type=int, default=0,
+                        help="split large files into jobs of this many exams (0 keeps one job per file)")
+    parser.add_argument('--commit-every', type=int, default=50,
+                        help="commit after this many exams (insert mode)")
+    parser.add_argument('--commit-seconds', type=float, default=None,
+                        help="also commit once the open batch is this many seconds old (insert mode)")
+    parser.add_argument('--delta', action='store_true',
+                        help="store a content hash per exam and only rewrite new or changed exams (insert mode); "
+                             "exams migrated without --delta have no hash yet and count as new")
+    parser.add_argument('--checkpoint', default=None,
+                        help="journal of committed exam_ids: a file path, or 'db' for a table; "
+                             "exams already in it are skipped, so an interrupted run resumes")
+    parser.add_argument('--metrics', default=None,
+                        help="append per-exam, per-batch and end-of-run phase timings to this JSON Lines file")
+    parser.add_argument('--id-block-size', type=int, default=BLOCK_SIZE,
+                        help="reserve ids from the sequences this many at a time and write a batch in one round trip "
+                             "(insert mode); 0 waits for RETURNING id instead")
+    parser.add_argument('--dedup', action='store_true',
+                        help="insert identical highlights, FAQs, documents and sections once and link them "
+                             "from every exam that has them (insert mode)")
+    parser.add_argument('--dedup-entries', type=int, default=MAX_ENTRIES,
+                        help="component rows remembered for --dedup; older ones are inserted again when seen")
+    parser.add_argument('--bulk', action='store_true',
+                        help="drop the secondary indexes of the exam tables for the load, then rebuild them in "
+                             "parallel and ANALYZE; indexes left dropped by a failed run are rebuilt first")
+    parser.add_argument('--merge-streams', action='store_true',
+                        help="read every stream file once beforehand and insert an exam listed under several "
+                             "streams only once, its most complete copy, linked to all of them")
+    parser.add_argument('--dead-letters', default=None,
+                        help="append every exam that fails to this JSON Lines file with the error and the phase "
+                             "it failed in; retry.py loads just those exams again")
+    args = parser.parse_args(argv)
+    if args.delta and args.mode == 'copy':
+        parser.error("--delta rewrites single exams and only works with --mode insert")
+    if args.dedup and args.mode == 'copy':
+        parser.error("--dedup only works with --mode insert")
+    if args.dedup and args.delta and args.workers > 1:
+        # A worker could link a shared row that another worker's delta is deleting
+        parser.error("--dedup with --delta needs --workers 1")
+    if args.bulk and args.delta:
+        # --delta deletes the components of every changed exam, which needs
+        # the component link indexes --bulk drops
+        parser.error("--bulk and --delta cannot be combined")
+    return args
+
 # Database connection details
-conn = psycopg2.connect(
-    host="localhost",
-    database="onlyeducation",
-    user="postgres",
-    password="seaCalf"
-)
-cursor = conn.cursor()
-
-# Insert into the 'exams_stream_links' table to link exams to a stream
-def link_exam_to_stream(exam_id, stream_id):
-    query = """
-    INSERT INTO onlyedudb.exams_stream_links (exam_id, stream_id)
-    VALUES (%s, %s) ON CONFLICT (exam_id, stream_id) DO NOTHING;
-    """
-    cursor.execute(query, (exam_id, stream_id))
-    conn.commit()
+DB_CONFIG = {
+    'host': "localhost",
+    'database': "onlyeducation",
+    'user': "postgres",
+    'password': "seaCalf"
+}
 
-# Function to convert array to HTML <ul> list
-def convert_array_to_html_list(array):
-    html_list = "<ul>"
-    for item in array:
-        html_list += f"<li>{item}</li>"
-    html_list += "</ul>"
-    return html_list
-
-# Helper function to handle 'N/A' or missing data
-def sanitize_data(value, data_type=None):
-    if value in ['N/A', '', None]:
-        return None
-    if data_type == 'integer' and isinstance(value, str):
-        try:
-            return int(value)
-        except ValueError:
-            return None
-    return value
-
-# Function to check if a slug already exists in the database
-def check_slug_exists(slug):
-    query = "SELECT EXISTS(SELECT 1 FROM onlyedudb.exams WHERE slug = %s);"
-    cursor.execute(query, (slug,))
-    return cursor.fetchone()[0]
-
-# Function to generate a unique slug
-def generate_unique_slug(title):
-    base_slug = slugify(title)
-    unique_slug = base_slug
-    count = 1
-    
-    while check_slug_exists(unique_slug):
-        unique_slug = f"{base_slug}-{count}"
-        count += 1
-
-    return unique_slug
-
-# Function to insert exam and return the generated exam ID
-def insert_exam(exam):
-    insert_exam_query = """
-    INSERT INTO onlyedudb.exams
-    (title, slug, conducting_body, accepting_colleges, total_applications, exam_type, exam_level, syllabus, created_at, updated_at)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    RETURNING id
-    """
-    
-    slug = generate_unique_slug(exam['exam_name'])
-    
-    cursor.execute(insert_exam_query, (
-        exam['exam_name'], 
-        slug, 
-        exam['conducting_body'], 
-        exam['accepting_colleges'], 
-        sanitize_data(exam['total_applications'], 'integer'),
-        exam['exam_type'], 
-        exam['exam_level'], 
-        Json(exam['syllabus']),
-        datetime.now(),
-        datetime.now()
-    ))
-
-    exam_id = cursor.fetchone()[0]
-    conn.commit()
-    return exam_id
-
-# Function to insert exam components
-def insert_exam_components(exam_id, exam):
-    # Insert highlights
-    for highlight in exam.get('highlights', []):
-        insert_highlight_query = """
-        INSERT INTO onlyedudb.components_exam_components_exam_highlights_tables (key, value)
-        VALUES (%s, %s) RETURNING id;
-        """
-        cursor.execute(insert_highlight_query, (highlight['key'], highlight['value']))
-        highlight_id = cursor.fetchone()[0]
-
-        link_query = """
-        INSERT INTO onlyedudb.exams_components (entity_id, component_id, component_type, field)
-        VALUES (%s, %s, %s, %s);
-        """
-        cursor.execute(link_query, (exam_id, highlight_id, 'highlight', 'highlights'))
-
-    # Insert FAQs
-    for faq in exam.get('faqs', []):
-        insert_faq_query = """
-        INSERT INTO onlyedudb.components_exam_components_faqs (question, answer)
-        VALUES (%s, %s) RETURNING id;
-        """
-        cursor.execute(insert_faq_query, (faq.get('question', None), faq.get('answer', None)))
-        faq_id = cursor.fetchone()[0]
-
-        link_query = """
-        INSERT INTO onlyedudb.exams_components (entity_id, component_id, component_type, field)
-        VALUES (%s, %s, %s, %s);
-        """
-        cursor.execute(link_query, (exam_id, faq_id, 'global.faq', 'faq'))
-
-    # Insert documents_required
-    if 'documents_required' in exam:
-        for document in exam['documents_required']:
-            document_html = convert_array_to_html_list(document.get('documents', []))
-            
-            insert_document_query = """
-            INSERT INTO onlyedudb.components_exam_components_doc_reqs (title, content)
-            VALUES (%s, %s) RETURNING id;
-            """
-            cursor.execute(insert_document_query, (
-                document.get('heading', None), 
-                document_html
-            ))
-            
-            document_id = cursor.fetchone()[0]
-
-            link_query = """
-            INSERT INTO onlyedudb.exams_components (entity_id, component_id, component_type, field)
-            VALUES (%s, %s, %s, %s);
-            """
-            cursor.execute(link_query, (exam_id, document_id, 'exam-components.doc-req', 'doc_req'))
-
-    # Insert sections
-    for section in exam.get('sections', []):
-        insert_section_query = """
-        INSERT INTO onlyedudb.components_course_compoents_sections (title, content)
-        VALUES (%s, %s) RETURNING id;
-        """
-        cursor.execute(insert_section_query, (section.get('title', None), section.get('content', None)))
-        section_id = cursor.fetchone()[0]
-
-        link_query = """
-        INSERT INTO onlyedudb.exams_components (entity_id, component_id, component_type, field)
-        VALUES (%s, %s, %s, %s);
-        """
-        cursor.execute(link_query, (exam_id, section_id, 'section', 'sections'))
+# Function to create an empty statistics dict
+def new_stats():
+    return {
+        'total_exams': 0,
+        'successful_migrations': 0,
+        'failed_migrations': 0,
+        'skipped_exams': 0,
+        'merged_exams': 0,
+        'unchanged_exams': 0,
+        'changed_exams': 0,
+        'successful_files': 0,
+        'failed_files': 0
+    }
 
-    conn.commit()
+# Migrates exams over one connection with its own statistics, so that several
+# of them can run side by side on pooled connections
+class ExamMigrator:
+    def __init__(self, conn, slug_registry, commit_every=1, commit_seconds=None, journal=None, delta=None, metrics=None,
+                 id_allocator=None, dedup=None, groups=None, dead_letters=None):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        # Exams are committed in batches, each one inside its own savepoint
+        self.transaction = TransactionPolicy(conn, commit_every, commit_seconds)
+        # Checkpoint journal of committed exam_ids, if the run is resumable
+        self.journal = journal
+        # Content hashes of earlier runs for --delta
+        self.delta = delta
+        # Exams of all stream files grouped by name for --merge-streams
+        self.groups = groups
+        # File failed exams are written to for retry.py, if there is one
+        self.dead_letters = dead_letters
+        # Phase timings, shared with the other workers of the run
+        self.metrics = metrics if metrics is not None else MigrationMetrics()
+        # Timer of the exam, batch or COPY job being worked on
+        self.timer = self.metrics.timer()
+        self.stats = new_stats()
+        self.failed_exams = []
+        # Writes exams, their components and stream links as EXAM_MAPPING declares,
+        # with ids from the shared IdAllocator and components shared through the
+        # ComponentIndex, if there are
+        self.writer = EntityWriter(self.cursor, EXAM_MAPPING, slug_registry, id_allocator, dedup)
 
-def process_json_file(filename):
-    """Process a single JSON file and return its data"""
-    try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        print(f"File not found: {filename}")
-        return None
-    except json.JSONDecodeError:
-        print(f"Invalid JSON in file: {filename}")
-        return None
+    # Insert into the 'exams_stream_links' table to link exams to a stream
+    def link_exam_to_stream(self, exam_id, stream_id):
+        self.writer.link_stream(exam_id, stream_id, self.timer)
 
-# Statistics tracking
-stats = {
-    'total_exams': 0,
-    'successful_migrations': 0,
-    'failed_migrations': 0,
-    'successful_files': 0,
-    'failed_files': 0
-}
+    # Function to get the streams to link an exam read from stream_id's file to
+    def stream_ids(self, exam, stream_id):
+        if self.groups is None:
+            return [stream_id]
+        return self.groups.stream_ids(exam, stream_id)
 
-failed_exams = []
+    # Function to build the key an exam's content hashes are stored under for
+    # --delta. The scraped exam_id changes on every crawl, so exams are matched
+    # on stream and name.
+    def record_key(self, exam, stream_id):
+        return record_key(stream_id, exam['exam_name'])
 
-# Main migration loop
-try:
-    for json_file, stream_id in STREAM_MAPPINGS.items():
-        print(f"\nProcessing {json_file} for stream ID {stream_id}")
-        exams_data = process_json_file(json_file)
-        
-        if exams_data is None:
-            stats['failed_files'] += 1
-            continue
-            
-        stats['successful_files'] += 1
-        exam_count = 0
-        
-        for exam in exams_data:
-            stats['total_exams'] += 1
+    # Function to insert exam and return the generated exam ID and slug
+    def insert_exam(self, exam):
+        return self.writer.insert(exam, self.timer)
+
+    # Function to stage exam components; they are written by commit_exams
+    def insert_exam_components(self, exam_id, exam):
+        self.writer.add_components(exam_id, exam, timer=self.timer)
+
+    # Function to write one exam, its stream link and its staged components
+    # without committing. Returns a pending entry of (exam, slug, delta entry);
+    # slug is None when an existing exam was updated, and the entry is None
+    # when --delta found the exam unchanged.
+    def migrate_exam(self, exam, stream_id):
+        if self.delta is None:
+            exam_id, slug = self.insert_exam(exam)
             try:
-                exam_id = insert_exam(exam)
-                insert_exam_components(exam_id, exam)
-                link_exam_to_stream(exam_id, stream_id)
-                exam_count += 1
-                stats['successful_migrations'] += 1
+                # Components first: staging them is the step that can fail, and
+                # a queued stream link would outlive this exam's savepoint
+                self.insert_exam_components(exam_id, exam)
+                for linked_stream_id in self.stream_ids(exam, stream_id):
+                    self.link_exam_to_stream(exam_id, linked_stream_id)
+            except Exception:
+                self.writer.discard(exam_id)
+                self.writer.release_slugs([slug])
+                raise
+            return exam, slug, None
+
+        key = self.record_key(exam, stream_id)
+        with self.timer.phase('delta_hash'):
+            hashes = self.delta.part_hashes(EXAM_MAPPING, exam)
+            status, exam_id, changed = self.delta.classify(key, hashes)
+
+        if status == 'unchanged':
+            return None
+
+        slug = None
+        if status == 'new':
+            exam_id, slug = self.insert_exam(exam)
+        try:
+            # The statements run now and go with this exam's savepoint, while
+            # components and links are queued for the flush and would not.
+            # So everything that can fail runs first and the queueing last.
+            specs = EXAM_MAPPING.components
+            if status == 'changed':
+                # Only the parts whose hash differs are rewritten
+                if 'entity' in changed:
+                    self.writer.update(exam_id, exam, self.timer)
+                specs = [spec for spec in EXAM_MAPPING.components if spec.field in changed]
+                self.writer.delete_components(exam_id, specs, self.timer)
+            delta_entry = self.delta.stage(self.cursor, key, exam_id, hashes)
+
+            # Staging builds every row before queueing any, so it fails whole
+            self.writer.add_components(exam_id, exam, specs, self.timer)
+            # Streams that now list a changed exam too are linked; existing links are kept
+            if status == 'new' or self.groups is not None:
+                for linked_stream_id in self.stream_ids(exam, stream_id):
+                    self.link_exam_to_stream(exam_id, linked_stream_id)
+        except Exception:
+            self.writer.discard(exam_id)
+            self.writer.release_slugs([slug])
+            raise
+        return exam, slug, delta_entry
+
+    # Function to commit the open transaction together with the checkpoints and
+    # content hashes of the exams it contains
+    def commit_pending(self, pending, json_file):
+        record_ids = [source_id(exam) for exam, _, _ in pending if source_id(exam)]
+        if self.journal is not None:
+            self.journal.stage(self.cursor, record_ids, json_file)
+        with self.timer.phase('commit'):
+            self.transaction.commit()
+        self.writer.confirm()
+        if self.journal is not None:
+            self.journal.confirm(record_ids)
+        if self.delta is not None:
+            self.delta.confirm([entry for _, _, entry in pending if entry])
+
+    # Function to write the staged components of the pending exams and commit
+    # them all. If the commit fails as a whole, every pending exam is replayed
+    # in its own transaction so one bad row only fails its own exam.
+    def commit_exams(self, pending, json_file, stream_id):
+        self.timer = self.metrics.timer()
+        exam_count = len(pending)
+        replayed = False
+        try:
+            self.writer.flush(self.timer)
+            self.commit_pending(pending, json_file)
+            succeeded = list(pending)
+        except Exception:
+            self.transaction.rollback()
+            self.writer.clear()
+            self.writer.release_slugs(slug for _, slug, _ in pending)
+            replayed = True
+
+            succeeded = []
+            for exam, _, _ in pending:
+                phase = 'stage'
+                try:
+                    entry = self.migrate_exam(exam, stream_id)
+                    phase = 'commit'
+                    try:
+                        self.writer.flush(self.timer)
+                        self.commit_pending([entry], json_file)
+                    except Exception:
+                        self.writer.release_slugs([entry[1]])
+                        raise
+                    succeeded.append(entry)
+                except Exception as e:
+                    self.transaction.rollback()
+                    self.writer.clear()
+                    self.record_failure(json_file, exam, e, stream_id, phase)
+
+        for exam, slug, _ in succeeded:
+            self.stats['successful_migrations'] += 1
+            if slug is None:
+                self.stats['changed_exams'] += 1
+                print(f"Successfully updated: {exam['exam_name']}")
+            else:
                 print(f"Successfully migrated: {exam['exam_name']}")
+
+        if exam_count:
+            self.timer.emit('batch', file=json_file, stream_id=stream_id, exams=exam_count,
+                            committed=len(succeeded), replayed=replayed)
+        pending.clear()
+        return len(succeeded)
+
+    # Function to record a failed exam in the statistics and the dead-letter
+    # file. phase is the step that failed: 'stage' writing the exam itself,
+    # 'commit' writing its batch's components and committing, 'copy_row'
+    # building its COPY rows or 'copy_load' the COPY job it was part of.
+    def record_failure(self, json_file, exam, error, stream_id, phase):
+        self.stats['failed_migrations'] += 1
+        self.failed_exams.append({
+            'file': json_file,
+            'exam_name': exam['exam_name'],
+            'error_class': type(error).__name__,
+            'phase': phase,
+            'error': str(error)
+        })
+        if self.dead_letters is not None:
+            key = self.record_key(exam, stream_id) if self.delta is not None else None
+            self.dead_letters.write(json_file, self.stream_ids(exam, stream_id), exam, error, phase, key)
+        print(f"Failed to migrate {exam['exam_name']} ({phase}): {str(error)}")
+
+    # Function to migrate a list of exams in a single COPY-based transaction.
+    # The id() of every exam whose rows could not be built goes into rejected.
+    def copy_exams(self, exams_data, json_file, stream_id, rejected=None):
+        def on_error(exam, error):
+            if rejected is not None:
+                rejected.add(id(exam))
+            self.record_failure(json_file, exam, error, stream_id, 'copy_row')
+
+        slugs = []
+        try:
+            # Reading the file and generating slugs happen inside the load and
+            # are part of its time as well as being timed on their own
+            staged_exams, slugs = self.writer.copy(
+                exams_data, lambda exam: self.stream_ids(exam, stream_id), on_error, self.timer
+            )
+            self.commit_pending([(exam, None, None) for exam in staged_exams], json_file)
+        except Exception:
+            self.conn.rollback()
+            self.writer.release_slugs(slugs)
+            raise
+
+        self.stats['successful_migrations'] += len(staged_exams)
+        return len(staged_exams)
+
+    # Function to count exams as they are read from a stream, timing the read,
+    # and skip the ones the checkpoint journal already has and, for
+    # --merge-streams, the copies of exams migrated from another stream file.
+    # With per_exam every exam gets a fresh timer, otherwise all go to the
+    # current one.
+    def exams_to_migrate(self, exams_data, per_exam=True):
+        exams = iter(exams_data)
+        while True:
+            started = time.perf_counter()
+            try:
+                exam = next(exams)
+            except StopIteration:
+                return
+            parsed = time.perf_counter() - started
+            if per_exam:
+                self.timer = self.metrics.timer()
+            self.timer.add('parse', parsed)
+
+            self.stats['total_exams'] += 1
+            if self.journal is not None and self.journal.is_done(source_id(exam)):
+                self.stats['skipped_exams'] += 1
+                continue
+            if self.groups is not None and not self.groups.is_chosen(exam):
+                self.stats['merged_exams'] += 1
+                continue
+            yield exam
+
+    # Function to migrate the exams of one job. Returns False when a COPY load
+    # failed as a whole or the file turned out to be invalid JSON part-way
+    # through, so the caller can count its file as failed.
+    def migrate(self, exams_data, json_file, stream_id, mode):
+        if mode == 'copy':
+            total_before = self.stats['total_exams'] - self.stats['skipped_exams'] - self.stats['merged_exams']
+            failed_before = self.stats['failed_migrations']
+            self.timer = self.metrics.timer()
+            exams = self.exams_to_migrate(exams_data, per_exam=False)
+            # The exams read are kept so a failed load can dead-letter each
+            # of them; the load keeps them until its commit anyway
+            read_exams = []
+            rejected = set()
+            if self.dead_letters is not None:
+                exams = remember(exams, read_exams)
+            try:
+                exam_count = self.copy_exams(exams, json_file, stream_id, rejected)
             except Exception as e:
-                stats['failed_migrations'] += 1
-                failed_exams.append({
+                self.timer.emit('copy_job', file=json_file, stream_id=stream_id, failed=True, error=str(e))
+                # COPY loads a job as a whole, so all of its exams are counted as failed
+                read = self.stats['total_exams'] - self.stats['skipped_exams'] - self.stats['merged_exams'] - total_before
+                self.stats['failed_migrations'] = failed_before + read
+                self.failed_exams.append({
                     'file': json_file,
-                    'exam_name': exam['exam_name'],
+                    'exam_name': '(entire file)',
+                    'error_class': type(e).__name__,
+                    'phase': 'copy_load',
                     'error': str(e)
                 })
-                print(f"Failed to migrate {exam['exam_name']}: {str(e)}")
-                conn.rollback()  # Rollback the failed transaction
+                if self.dead_letters is not None:
+                    # Exams whose rows could not be built are in the file already
+                    for exam in read_exams:
+                        if id(exam) not in rejected:
+                            self.dead_letters.write(json_file, self.stream_ids(exam, stream_id), exam, e, 'copy_load')
+                print(f"Failed to copy {json_file}: {str(e)}")
+                return False
+            self.timer.emit('copy_job', file=json_file, stream_id=stream_id, failed=False, exams=exam_count)
+            print(f"Completed {json_file}: {exam_count} exams processed")
+            return True
+
+        exam_count = 0
+        pending = []
+        completed = True
+        
+        try:
+            for exam in self.exams_to_migrate(exams_data):
+                try:
+                    with self.transaction.savepoint():
+                        entry = self.migrate_exam(exam, stream_id)
+                    if entry is None:
+                        self.stats['unchanged_exams'] += 1
+                        status = 'unchanged'
+                    else:
+                        pending.append(entry)
+                        status = 'staged'
+                except Exception as e:
+                    # Only this exam was rolled back, the open batch is kept
+                    self.record_failure(json_file, exam, e, stream_id, 'stage')
+                    status = 'failed'
+                self.timer.emit('exam', file=json_file, stream_id=stream_id, exam=exam.get('exam_name'), status=status)
+
+                if self.transaction.due(len(pending)):
+                    exam_count += self.commit_exams(pending, json_file, stream_id)
+        except json.JSONDecodeError:
+            # Exams read before the invalid part are still migrated
+            completed = False
+
+        exam_count += self.commit_exams(pending, json_file, stream_id)
                 
         print(f"Completed {json_file}: {exam_count} exams processed")
+        return completed
 
-except Exception as e:
-    print(f"An error occurred during migration: {str(e)}")
-    conn.rollback()
-
-finally:
-    # Print final statistics
-    print("\nMigration Summary:")
-    print("=" * 50)
-    print(f"Total files processed: {stats['successful_files'] + stats['failed_files']}")
-    print(f"Successful files: {stats['successful_files']}")
-    print(f"Failed files: {stats['failed_files']}")
-    print(f"Total exams processed: {stats['total_exams']}")
-    print(f"Successful migrations: {stats['successful_migrations']}")
-    print(f"Failed migrations: {stats['failed_migrations']}")
-    
-    if failed_exams:
-        print("\nFailed Exams:")
-        for fail in failed_exams:
-            print(f"\nFile: {fail['file']}")
-            print(f"Exam: {fail['exam_name']}")
-            print(f"Error: {fail['error']}")
+    def close(self):
+        self.transaction.close()
+        self.cursor.close()
+
+# Function to pass exams through while keeping each of them in a list
+def remember(exams, kept):
+    for exam in exams:
+        kept.append(exam)
+        yield exam
+
+def process_json_file(filename):
+    """Open a single JSON file and return a stream of its exams"""
+    try:
+        file = open(filename, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        print(f"File not found: {filename}")
+        return None
+    return stream_json_file(file, filename)
+
+# Function to yield the exams of an open file one at a time, restructured
+# into sections if they are in the old scraped shape. Invalid JSON is only
+# found while reading, so it is reported here and re-raised.
+def stream_json_file(file, filename):
+    with file:
+        try:
+            yield from restructure_exams(iter_json_array(file))
+        except json.JSONDecodeError:
+            print(f"Invalid JSON in file: {filename}")
+            raise
+
+# Function to read the exams of a file for the --merge-streams pre-pass.
+# Missing and invalid files are reported by the migration itself.
+def scan_json_file(filename):
+    try:
+        with open(filename, 'r', encoding='utf-8') as file:
+            yield from restructure_exams(iter_json_array(file))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+
+# Function to split the exams of a file into jobs of --chunk-size exams,
+# reading only one chunk ahead
+def split_into_jobs(exams_data, chunk_size):
+    if chunk_size <= 0:
+        yield exams_data
+        return
+    while True:
+        job = list(islice(exams_data, chunk_size))
+        if not job:
+            return
+        yield job
+
+# Function to run one job on a connection borrowed from the pool
+def run_pooled_job(pool, args, slug_registry, journal, delta, metrics, id_allocator, dedup, groups, dead_letters,
+                   exams_data, json_file, stream_id):
+    conn = pool.getconn()
+    migrator = ExamMigrator(conn, slug_registry, args.commit_every, args.commit_seconds, journal, delta, metrics,
+                            id_allocator, dedup, groups, dead_letters)
+    try:
+        succeeded = migrator.migrate(exams_data, json_file, stream_id, args.mode)
+    finally:
+        migrator.close()
+        conn.rollback()  # Return the connection to the pool without an open transaction
+        pool.putconn(conn)
+    return migrator, succeeded
+
+# Function to add a worker's statistics and failures to the run totals
+def merge_results(stats, failed_exams, migrator):
+    for key, value in migrator.stats.items():
+        stats[key] += value
+    failed_exams.extend(migrator.failed_exams)
+
+# Function to run a full migration of every file in STREAM_MAPPINGS
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Statistics tracking
+    stats = new_stats()
+
+    failed_exams = []
+
+    # Files that were invalid JSON or had a COPY job fail as a whole
+    failed_job_files = set()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+
+    # Every slug already in exams, loaded once so new slugs need no lookups.
+    # All workers share it, so parallel jobs never hand out the same slug.
+    with conn.cursor() as slug_cursor:
+        slug_registry = SlugRegistry.load(slug_cursor, 'onlyedudb.exams')
+    conn.commit()
+
+    # Committed exam_ids of earlier runs, shared by all workers
+    journal = open_checkpoint_journal(args.checkpoint, conn) if args.checkpoint else None
+
+    # Content hashes of exams migrated by earlier --delta runs
+    delta = DeltaIndex(conn, 'exam') if args.delta else None
+
+    # Phase timings of every worker, reported at the end of the run
+    metrics = MigrationMetrics(args.metrics)
+
+    # Blocks of sequence ids handed out to every worker
+    id_allocator = IdAllocator(args.id_block_size) if args.id_block_size > 0 else None
+
+    # Committed component rows by content, shared by every worker for --dedup
+    dedup = ComponentIndex(args.dedup_entries) if args.dedup else None
+
+    # Every stream each exam is listed under, from a pre-pass over all files
+    groups = None
+    if args.merge_streams:
+        groups = ExamGroups.scan(EXAM_MAPPING, (
+            (stream_id, scan_json_file(json_file)) for json_file, stream_id in STREAM_MAPPINGS.items()
+        ))
+
+    # Failed exams of every worker, for retry.py
+    dead_letters = DeadLetterFile(args.dead_letters) if args.dead_letters else None
+
+    # Secondary indexes dropped for --bulk, rebuilt after the load on --workers connections
+    bulk = None
+    if args.bulk:
+        bulk = BulkIndexes(lambda: psycopg2.connect(**DB_CONFIG), mapping_tables(EXAM_MAPPING), args.workers)
+        bulk.drop()
+
+    # Main migration loop
+    try:
+        if args.workers <= 1:
+            migrator = ExamMigrator(conn, slug_registry, args.commit_every, args.commit_seconds, journal, delta, metrics,
+                                    id_allocator, dedup, groups, dead_letters)
+            try:
+                for json_file, stream_id in STREAM_MAPPINGS.items():
+                    print(f"\nProcessing {json_file} for stream ID {stream_id}")
+                    exams_data = process_json_file(json_file)
+                
+                    if exams_data is None:
+                        stats['failed_files'] += 1
+                        continue
+                    
+                    stats['successful_files'] += 1
+                    try:
+                        for job in split_into_jobs(exams_data, args.chunk_size):
+                            if not migrator.migrate(job, json_file, stream_id, args.mode):
+                                failed_job_files.add(json_file)
+                    except json.JSONDecodeError:
+                        failed_job_files.add(json_file)
+            finally:
+                merge_results(stats, failed_exams, migrator)
+                migrator.close()
+        else:
+            # Each stream file, or each chunk of one, runs on its own pooled connection
+            pool = ThreadedConnectionPool(1, args.workers, **DB_CONFIG)
+            # Bounds the chunks read ahead of the workers
+            in_flight = BoundedSemaphore(args.workers * 2)
+            try:
+                with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                    futures = []
+                    for json_file, stream_id in STREAM_MAPPINGS.items():
+                        print(f"\nQueueing {json_file} for stream ID {stream_id}")
+                        exams_data = process_json_file(json_file)
+
+                        if exams_data is None:
+                            stats['failed_files'] += 1
+                            continue
+
+                        stats['successful_files'] += 1
+                        try:
+                            for job in split_into_jobs(exams_data, args.chunk_size):
+                                in_flight.acquire()
+                                future = executor.submit(run_pooled_job, pool, args, slug_registry, journal, delta, metrics, id_allocator,
+                                                         dedup, groups, dead_letters, job, json_file, stream_id)
+                                future.add_done_callback(lambda _: in_flight.release())
+                                futures.append((future, json_file))
+                        except json.JSONDecodeError:
+                            failed_job_files.add(json_file)
+
+                    for future, json_file in futures:
+                        try:
+                            migrator, succeeded = future.result()
+                        except Exception as e:
+                            # The job could not even get going, e.g. no connection
+                            failed_job_files.add(json_file)
+                            failed_exams.append({'file': json_file, 'exam_name': '(entire job)',
+                                                 'error_class': type(e).__name__, 'phase': 'job', 'error': str(e)})
+                            print(f"Failed to run job for {json_file}: {str(e)}")
+                            continue
+                        merge_results(stats, failed_exams, migrator)
+                        if not succeeded:
+                            failed_job_files.add(json_file)
+            finally:
+                pool.closeall()
+
+    except Exception as e:
+        print(f"An error occurred during migration: {str(e)}")
+        conn.rollback()
+
+    finally:
+        # Indexes dropped for --bulk are rebuilt whether or not the load succeeded
+        if bulk is not None:
+            try:
+                bulk.restore()
+            except Exception as e:
+                print(f"Failed to rebuild indexes, run again with --bulk to retry: {str(e)}")
+
+        # A file counts as failed if it was invalid JSON or any of its COPY jobs failed as a whole
+        stats['successful_files'] -= len(failed_job_files)
+        stats['failed_files'] += len(failed_job_files)
+
+        # Print final statistics
+        print("\nMigration Summary:")
+        print("=" * 50)
+        print(f"Total files processed: {stats['successful_files'] + stats['failed_files']}")
+        print(f"Successful files: {stats['successful_files']}")
+        print(f"Failed files: {stats['failed_files']}")
+        print(f"Total exams processed: {stats['total_exams']}")
+        print(f"Successful migrations: {stats['successful_migrations']}")
+        print(f"Failed migrations: {stats['failed_migrations']}")
+        print(f"Skipped (already checkpointed): {stats['skipped_exams']}")
+        if groups is not None:
+            print(f"Merged into the same exam from another stream: {stats['merged_exams']}")
+        if delta is not None:
+            print(f"Unchanged exams: {stats['unchanged_exams']}")
+            print(f"Changed exams: {stats['changed_exams']}")
+        if dedup is not None:
+            print(f"Components linked instead of inserted again: {dedup.hits}")
     
-    cursor.close()
-    conn.close()
-    print("\nMigration process completed!")
\ No newline at end of file
+        if failed_exams:
+            print("\nFailed Exams:")
+            for fail in failed_exams:
+                print(f"\nFile: {fail['file']}")
+                print(f"Exam: {fail['exam_name']}")
+                print(f"Phase: {fail['phase']}")
+                print(f"Error: {fail['error_class']}: {fail['error']}")
+        if dead_letters is not None:
+            print(f"\n{dead_letters.count} failed exams written to {args.dead_letters}; "
+                  f"load them again with: python retry.py {args.dead_letters}")
+            dead_letters.close()
+
+        metrics.report(stats)
+        metrics.close()
+        if journal is not None:
+            journal.close()
+        conn.close()
+        print("\nMigration process completed!")
+
+
+if __name__ == '__main__':
+    main()
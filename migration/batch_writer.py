@@ -0,0 +1,216 @@
+import time
+from collections import defaultdict
+from psycopg2.extras import execute_values
+from component_dedup import row_key
+from metrics import timed
+
+LINK_COLUMNS = ('entity_id', 'component_id', 'component_type', 'field')
+
+
+# Function to render a multi-row INSERT as one complete statement, with the
+# values quoted by the driver
+def insert_statement(cursor, table, columns, rows):
+    template = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    values = b', '.join(cursor.mogrify(template, row) for row in rows)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ".encode('utf-8') + values
+
+
+# Describes one polymorphic component type: the table its rows go to, the
+# columns written there, the component_type/field stored on the link row and
+# a function that turns a source record into the row tuples to insert.
+class ComponentSpec:
+    def __init__(self, table, columns, component_type, field, rows):
+        self.table = table
+        self.columns = columns
+        self.component_type = component_type
+        self.field = field
+        self.rows = rows
+
+
+# Collects the components of many records and writes them set-based: one
+# multi-row INSERT ... RETURNING id per component type, then one INSERT for
+# all the matching link rows. Round trips grow with batches, not with rows.
+# With an IdAllocator the component ids are assigned client-side instead, so
+# no statement waits for another and all of them go in a single round trip.
+# With a ComponentIndex, rows identical to one already written are not
+# inserted again; only a link to the existing row is added.
+class ComponentBatchWriter:
+    def __init__(self, cursor, link_table, specs, id_allocator=None, dedup=None):
+        self.cursor = cursor
+        self.link_table = link_table
+        self.specs = specs
+        self.id_allocator = id_allocator
+        self.dedup = dedup
+        self.pending = {spec: [] for spec in specs}
+        # Rows written since the last commit, {key: (table, id)}. Only this
+        # writer may link to them until confirm hands them to the index.
+        self.uncommitted = {}
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.pending.values())
+
+    # Stage every component of one record, or only those of the given specs.
+    # Rows are built before anything is staged so a malformed record raises
+    # without leaving partial rows behind.
+    def add(self, entity_id, record, specs=None):
+        staged = [(spec, [(entity_id, row) for row in spec.rows(record)]) for spec in (self.specs if specs is None else specs)]
+        for spec, rows in staged:
+            self.pending[spec].extend(rows)
+
+    # Function to drop everything staged and every row not yet committed,
+    # after the transaction was rolled back
+    def clear(self):
+        self.drop_staged()
+        self.uncommitted.clear()
+
+    def drop_staged(self):
+        for rows in self.pending.values():
+            rows.clear()
+
+    # Function to drop the staged rows of one entity, whose savepoint was
+    # rolled back
+    def discard(self, entity_id):
+        for rows in self.pending.values():
+            rows[:] = [staged for staged in rows if staged[0] != entity_id]
+
+    # Function to make the rows of a committed transaction reusable by every
+    # writer sharing the index
+    def confirm(self):
+        if self.dedup is not None:
+            self.dedup.add((key, table, component_id) for key, (table, component_id) in self.uncommitted.items())
+        self.uncommitted.clear()
+
+    # Function to stop linking to rows of a table that were deleted
+    def forget(self, table, component_ids):
+        if self.dedup is None:
+            return
+        component_ids = set(component_ids)
+        self.dedup.forget(table, component_ids)
+        for key, (row_table, component_id) in list(self.uncommitted.items()):
+            if row_table == table and component_id in component_ids:
+                del self.uncommitted[key]
+
+    # Function to split the staged rows of one spec into the distinct rows to
+    # insert, their dedup keys, and one (entity_id, existing id, position)
+    # target per staged row: either the id of an identical row already written
+    # or the position of its row among those to insert
+    def plan(self, spec, staged):
+        rows = []
+        keys = []
+        targets = []
+        positions = {}
+        for entity_id, row in staged:
+            if self.dedup is None:
+                targets.append((entity_id, None, len(rows)))
+                rows.append(row)
+                continue
+            key = row_key(self.link_table, spec, row)
+            component_id = self.lookup(key)
+            if component_id is not None:
+                targets.append((entity_id, component_id, None))
+                continue
+            if key not in positions:
+                positions[key] = len(rows)
+                rows.append(row)
+                keys.append(key)
+            targets.append((entity_id, None, positions[key]))
+        return rows, keys, targets
+
+    def lookup(self, key):
+        row = self.uncommitted.get(key)
+        if row is not None:
+            return row[1]
+        return self.dedup.get(key)
+
+    # Function to build the link rows of one spec once its new rows have ids,
+    # remembering those rows for dedup
+    def resolve(self, spec, keys, targets, ids):
+        for key, component_id in zip(keys, ids):
+            self.uncommitted[key] = (spec.table, component_id)
+        return [
+            (entity_id, component_id if component_id is not None else ids[position], spec.component_type, spec.field)
+            for entity_id, component_id, position in targets
+        ]
+
+    # Send everything staged so far and return the number of link rows written.
+    # Each statement is timed on the given PhaseTimer, if any. Committing is
+    # left to the caller.
+    def flush(self, timer=None):
+        if self.id_allocator is not None:
+            statements, link_count = self.statements(timer)
+            if statements:
+                with timed(timer, 'bulk_write', link_count):
+                    self.cursor.execute(b';\n'.join(statements))
+            return link_count
+
+        links = []
+        for spec in self.specs:
+            staged = self.pending[spec]
+            if not staged:
+                continue
+
+            rows, keys, targets = self.plan(spec, staged)
+            ids = []
+            if rows:
+                insert_query = f"""
+                INSERT INTO {spec.table} ({', '.join(spec.columns)})
+                VALUES %s RETURNING id;
+                """
+                # RETURNING yields ids in VALUES order, which pairs each id with its row
+                with timed(timer, f'components.{spec.field}', len(rows)):
+                    ids = [component_id for (component_id,) in
+                           execute_values(self.cursor, insert_query, rows, page_size=len(rows), fetch=True)]
+            links.extend(self.resolve(spec, keys, targets, ids))
+
+        if links:
+            link_query = f"""
+            INSERT INTO {self.link_table} (entity_id, component_id, component_type, field)
+            VALUES %s;
+            """
+            with timed(timer, 'component_links', len(links)):
+                execute_values(self.cursor, link_query, links, page_size=len(links))
+
+        self.drop_staged()
+        return len(links)
+
+    # Function to render everything staged so far as INSERT statements with
+    # ids taken from the IdAllocator, and clear it. Returns the statements,
+    # none of which depends on another, and the number of link rows in them.
+    # They all travel in one round trip, so each component type is timed
+    # under components.<field> while its rows are planned and rendered.
+    def statements(self, timer=None):
+        plans = []
+        elapsed = {}
+        for spec in self.specs:
+            if not self.pending[spec]:
+                continue
+            started = time.perf_counter()
+            plans.append((spec, self.plan(spec, self.pending[spec])))
+            elapsed[spec] = time.perf_counter() - started
+        if not plans:
+            return [], 0
+
+        counts = defaultdict(int)
+        for spec, (rows, _, _) in plans:
+            counts[spec.table] += len(rows)
+        with timed(timer, 'id_allocation'):
+            ids = {table: iter(table_ids) for table, table_ids in self.id_allocator.take(self.cursor, counts).items()}
+
+        statements = []
+        links = []
+        for spec, (rows, keys, targets) in plans:
+            started = time.perf_counter()
+            component_ids = [next(ids[spec.table]) for _ in rows]
+            if rows:
+                statements.append(insert_statement(
+                    self.cursor, spec.table, ('id',) + tuple(spec.columns),
+                    [(component_id,) + tuple(row) for component_id, row in zip(component_ids, rows)]
+                ))
+            links.extend(self.resolve(spec, keys, targets, component_ids))
+            if timer is not None:
+                timer.add(f'components.{spec.field}', elapsed[spec] + time.perf_counter() - started, len(rows))
+        with timed(timer, 'component_links', len(links)):
+            statements.append(insert_statement(self.cursor, self.link_table, LINK_COLUMNS, links))
+
+        self.drop_staged()
+        return statements, len(links)
@@ -0,0 +1,296 @@
+import argparse
+import contextlib
+import copy
+import importlib.util
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import uuid
+
+import psycopg2
+from component_dedup import MAX_ENTRIES, ComponentIndex
+from exam_groups import ExamGroups
+from id_allocator import BLOCK_SIZE, IdAllocator
+from json_stream import iter_json_array
+from mappings import COURSE_MAPPING, EXAM_MAPPING
+from modify import restructure_exams
+from recording_connection import RecordingConnection
+from slug_registry import SlugRegistry
+import MigrateExam2
+
+# Offline benchmark of the exam and course migrators. Runs them against a
+# RecordingConnection, which counts round trips, rows and bytes per statement
+# type without a server, or against a real Postgres: a DSN, or a throwaway
+# local cluster seeded with schema.sql. Inputs are the real stream files and
+# synthetic corpora scaled up from them.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILE = os.path.join(HERE, 'schema.sql')
+COURSE_MIGRATION = os.path.join(HERE, '..', 'Course', 'course_migration', 'migration.py')
+
+# Synthetic courses generated per unit of --scale
+COURSES_PER_SCALE = 100
+
+# Tables emptied between runs against a real database
+BENCHMARK_TABLES = (
+    'onlyedudb.exams', 'onlyedudb.exams_stream_links', 'onlyedudb.exams_components',
+    'onlyedudb.components_exam_components_exam_highlights_tables',
+    'onlyedudb.components_exam_components_faqs', 'onlyedudb.components_exam_components_doc_reqs',
+    'onlyedudb.components_course_compoents_sections', 'onlyedudb.coursees', 'onlyedudb.coursees_components',
+    'onlyedudb.colleges', 'onlyedudb.colleges_components', 'onlyedudb.components_college_components_courses',
+    'onlyedudb.components_college_components_tab_sections', 'onlyedudb.components_college_components_facilities',
+)
+
+
+# Command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the exam and course migrations")
+    parser.add_argument('--target', choices=['fake', 'local', 'dsn'], default='fake',
+                        help="fake: count round trips without a server; local: a throwaway Postgres "
+                             "started with initdb; dsn: the database given with --dsn")
+    parser.add_argument('--dsn', default=None,
+                        help="connection string for --target dsn; its onlyedudb tables are truncated")
+    parser.add_argument('--entity', choices=['exams', 'courses'], nargs='+', default=['exams', 'courses'])
+    parser.add_argument('--mode', choices=['insert', 'copy'], nargs='+', default=['insert', 'copy'])
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10],
+                        help="corpus sizes: 1 is the real stream files, N repeats them N times under new names")
+    parser.add_argument('--commit-every', type=int, default=50,
+                        help="commit after this many exams (insert mode)")
+    parser.add_argument('--id-block-size', type=int, default=BLOCK_SIZE,
+                        help="ids reserved per sequence query; 0 runs the RETURNING id path instead")
+    parser.add_argument('--dedup', action='store_true',
+                        help="share identical component rows between records (insert mode)")
+    parser.add_argument('--merge-streams', action='store_true',
+                        help="insert exams listed under several streams once (exams only)")
+    parser.add_argument('--rtt-ms', type=float, default=0.0,
+                        help="network round trip to add per counted round trip when estimating "
+                             "the time of a --target fake run")
+    parser.add_argument('--statements', action='store_true',
+                        help="also print round trips, rows and bytes per statement type (fake target)")
+    args = parser.parse_args(argv)
+    if args.target == 'dsn' and not args.dsn:
+        parser.error("--target dsn needs --dsn")
+    return args
+
+
+# Function to read every exam of the real stream files that exist, as
+# (json_file, stream_id, exams) tuples
+def load_stream_files():
+    streams = []
+    for json_file, stream_id in MigrateExam2.STREAM_MAPPINGS.items():
+        path = os.path.join(HERE, json_file)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as file:
+            streams.append((json_file, stream_id, list(restructure_exams(iter_json_array(file)))))
+    return streams
+
+
+# Function to build an exam corpus: the real files at scale 1, each exam
+# repeated under a new name and exam_id at larger scales
+def exam_corpus(streams, scale):
+    corpus = []
+    for json_file, stream_id, exams in streams:
+        scaled = list(exams)
+        for copy_number in range(1, scale):
+            for exam in exams:
+                exam = copy.deepcopy(exam)
+                exam['exam_name'] = f"{exam['exam_name']} {copy_number}"
+                exam['exam_id'] = str(uuid.uuid4())
+                scaled.append(exam)
+        corpus.append((json_file, stream_id, scaled))
+    return corpus
+
+
+# Function to generate courses shaped like CoursesSpider output
+def course_corpus(scale):
+    return [
+        {
+            'title': f"Synthetic Course {number}",
+            'average_duration': f"{number % 5 + 1} Years",
+            'average_fees': f"INR {(number % 20 + 1) * 25000}",
+            'description': f"<p>Synthetic course {number} for benchmarking the course migration.</p>" * 4,
+            'sections': [
+                {'title': f"Section {section}", 'content': f"<p>{'Content of the section. ' * 40}</p>"}
+                for section in range(6)
+            ],
+            'faqs': [
+                {'question': f"Question {faq} about course {number}?", 'answer': f"<p>{'Answer text. ' * 20}</p>"}
+                for faq in range(5)
+            ],
+        }
+        for number in range(COURSES_PER_SCALE * scale)
+    ]
+
+
+# Function to count the component rows the given specs produce for the
+# records. A record the migrator would fail on adds none.
+def count_components(records, specs):
+    total = 0
+    for record in records:
+        try:
+            total += sum(len(spec.rows(record)) for spec in specs)
+        except Exception:
+            pass
+    return total
+
+
+# Function to load the course migration module without running it
+def load_course_migration():
+    spec = importlib.util.spec_from_file_location('course_migration', COURSE_MIGRATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Function to find a Postgres server binary on PATH or under pg_config --bindir
+def postgres_binary(name):
+    found = shutil.which(name)
+    if found:
+        return found
+    try:
+        bindir = subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        raise SystemExit(f"{name} not found; install Postgres or use --target fake or --target dsn")
+    return os.path.join(bindir, name)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Starts a throwaway Postgres cluster in a temporary directory, listening on a
+# unix socket only, and yields a DSN for it. Everything is removed on exit.
+@contextlib.contextmanager
+def local_postgres():
+    data_dir = tempfile.mkdtemp(prefix='onlyedu-bench-')
+    port = free_port()
+    try:
+        subprocess.run([postgres_binary('initdb'), '-D', data_dir, '-U', 'postgres', '--auth=trust'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([postgres_binary('pg_ctl'), '-D', data_dir, '-w', '-l', os.path.join(data_dir, 'server.log'),
+                        '-o', f"-k {data_dir} -p {port} -c listen_addresses='' -c fsync=off",
+                        'start'], check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield f"host={data_dir} port={port} dbname=postgres user=postgres"
+        finally:
+            subprocess.run([postgres_binary('pg_ctl'), '-D', data_dir, '-m', 'immediate', 'stop'],
+                           stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+# Function to create the onlyedudb tables once, then empty them before each run
+def reset_database(dsn):
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('onlyedudb.exams');")
+        if cursor.fetchone()[0] is None:
+            with open(SCHEMA_FILE, 'r', encoding='utf-8') as schema:
+                cursor.execute(schema.read())
+        cursor.execute(f"TRUNCATE {', '.join(BENCHMARK_TABLES)} RESTART IDENTITY;")
+    conn.commit()
+    return conn
+
+
+# Function to open the connection of one run
+def connect(args, dsn):
+    if args.target == 'fake':
+        return RecordingConnection()
+    return reset_database(dsn)
+
+
+# Function to migrate an exam corpus and return (exams, components, seconds)
+def run_exams(conn, corpus, mode, commit_every, id_block_size, dedup, merge_streams):
+    with conn.cursor() as cursor:
+        slug_registry = SlugRegistry.load(cursor, 'onlyedudb.exams')
+    conn.commit()
+    if isinstance(conn, RecordingConnection):
+        conn.reset()
+
+    id_allocator = IdAllocator(id_block_size) if id_block_size > 0 else None
+    dedup = ComponentIndex() if dedup and mode == 'insert' else None
+    started = time.perf_counter()
+    # The pre-pass groups the corpus already in memory, so reading the files again is not part of the timing
+    groups = ExamGroups.scan(EXAM_MAPPING, ((stream_id, exams) for _, stream_id, exams in corpus)) if merge_streams else None
+    migrator = MigrateExam2.ExamMigrator(conn, slug_registry, commit_every, id_allocator=id_allocator, dedup=dedup,
+                                         groups=groups)
+    for json_file, stream_id, exams in corpus:
+        migrator.migrate(iter(exams), json_file, stream_id, mode)
+    seconds = time.perf_counter() - started
+    migrator.close()
+
+    exams = sum(len(exams) for _, _, exams in corpus)
+    return exams, count_components((exam for _, _, exams in corpus for exam in exams), EXAM_MAPPING.components), seconds
+
+
+# Function to migrate a course corpus and return (courses, components, seconds)
+def run_courses(conn, course_migration, courses, mode, id_block_size, dedup):
+    if isinstance(conn, RecordingConnection):
+        conn.reset()
+    started = time.perf_counter()
+    # Slugs are loaded inside migrate_courses, so that query is part of the timing
+    course_migration.migrate_courses(conn, iter(courses), mode, id_block_size=id_block_size,
+                                     dedup_entries=MAX_ENTRIES if dedup and mode == 'insert' else None)
+    seconds = time.perf_counter() - started
+    return len(courses), count_components(courses, COURSE_MAPPING.components), seconds
+
+
+# Function to print the result of one run as a table row, plus its statement
+# breakdown when asked for
+def report(args, conn, entity, scale, mode, records, components, seconds):
+    round_trips = None
+    if isinstance(conn, RecordingConnection):
+        totals = conn.totals()
+        round_trips = totals['round_trips']
+        seconds += round_trips * args.rtt_ms / 1000
+
+    seconds = max(seconds, 1e-9)
+    trips = f"{round_trips / records:>10.2f}" if round_trips is not None and records else f"{'-':>10}"
+    print(f"{entity:<8} {scale:>5} {mode:<6} {records:>8} {components:>10} {seconds:>9.2f} "
+          f"{records / seconds:>10.1f} {components / seconds:>12.1f} {trips}")
+
+    if args.statements and isinstance(conn, RecordingConnection):
+        for kind, entry in sorted(conn.stats.items()):
+            print(f"{'':>8} {kind:<12} round trips {entry['round_trips']:>8}  rows {entry['rows']:>9}  "
+                  f"bytes {entry['bytes']:>12}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    streams = load_stream_files() if 'exams' in args.entity else []
+    course_migration = load_course_migration() if 'courses' in args.entity else None
+
+    with contextlib.ExitStack() as stack:
+        dsn = args.dsn
+        if args.target == 'local':
+            dsn = stack.enter_context(local_postgres())
+
+        print(f"{'entity':<8} {'scale':>5} {'mode':<6} {'records':>8} {'components':>10} {'seconds':>9} "
+              f"{'records/s':>10} {'components/s':>12} {'trips/rec':>10}")
+        for scale in args.scale:
+            exams = exam_corpus(streams, scale) if streams else None
+            courses = course_corpus(scale) if course_migration else None
+            for mode in args.mode:
+                if exams:
+                    conn = connect(args, dsn)
+                    # The migrators print a line per record, which would drown the report
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                        result = run_exams(conn, exams, mode, args.commit_every, args.id_block_size, args.dedup, args.merge_streams)
+                    report(args, conn, 'exams', scale, mode, *result)
+                    conn.close()
+                if courses:
+                    conn = connect(args, dsn)
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                        result = run_courses(conn, course_migration, courses, mode, args.id_block_size, args.dedup)
+                    report(args, conn, 'courses', scale, mode, *result)
+                    conn.close()
+
+
+if __name__ == '__main__':
+    main()
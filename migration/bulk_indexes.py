@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Function to list the tables a full load of a mapping writes to
+def mapping_tables(mapping):
+    tables = [mapping.table, mapping.link_table]
+    if mapping.stream_link:
+        tables.append(mapping.stream_link[0])
+    tables.extend(spec.table for spec in mapping.components)
+    return list(dict.fromkeys(tables))
+
+
+# Drops the secondary indexes of the tables a bulk load writes to and builds
+# them again once it is done, which is much cheaper than maintaining them row
+# by row. Primary keys, unique indexes and any index backing a constraint
+# stay, since ON CONFLICT and the CMS rely on them.
+#
+# Every dropped index is recorded in a table in the same transaction as the
+# DROP, and only removed from it in the transaction that recreates it, so a
+# run that dies half-way leaves a record to restore from: drop restores any
+# leftovers before dropping again.
+class BulkIndexes:
+    TABLE = 'onlyedudb.migration_dropped_indexes'
+
+    def __init__(self, connect, tables, workers=2):
+        # connect() opens a new connection; restore builds indexes on several
+        self.connect = connect
+        self.tables = tables
+        self.workers = max(workers, 1)
+
+    # Function to record and drop the secondary indexes of the tables.
+    # Returns the names of the indexes dropped.
+    def drop(self):
+        self.restore(analyze=False)
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                SELECT index_class.oid::regclass::text, table_class.oid::regclass::text,
+                       pg_get_indexdef(index_class.oid)
+                FROM pg_index AS i
+                JOIN pg_class AS index_class ON index_class.oid = i.indexrelid
+                JOIN pg_class AS table_class ON table_class.oid = i.indrelid
+                WHERE i.indrelid IN (SELECT to_regclass(name) FROM unnest(%s::text[]) AS name)
+                AND NOT i.indisprimary AND NOT i.indisunique
+                AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid);
+                """, (self.tables,))
+                indexes = cursor.fetchall()
+                for index_name, table_name, definition in indexes:
+                    cursor.execute(
+                        f"INSERT INTO {self.TABLE} (index_name, table_name, definition) VALUES (%s, %s, %s);",
+                        (index_name, table_name, definition)
+                    )
+                    cursor.execute(f"DROP INDEX {index_name};")
+            conn.commit()
+        finally:
+            conn.close()
+        print(f"Dropped {len(indexes)} secondary indexes for the bulk load")
+        return [index_name for index_name, _, _ in indexes]
+
+    # Function to build every recorded index again, several at a time, and
+    # ANALYZE the tables. Indexes that fail to build stay recorded and the
+    # first error is raised once all the others have been tried.
+    def restore(self, analyze=True):
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                    index_name text PRIMARY KEY,
+                    table_name text NOT NULL,
+                    definition text NOT NULL,
+                    dropped_at timestamp NOT NULL DEFAULT now()
+                );
+                """)
+                cursor.execute(f"SELECT index_name, table_name, definition FROM {self.TABLE};")
+                indexes = cursor.fetchall()
+            conn.commit()
+
+            # Each index is built on its own connection; the server may also
+            # use parallel workers for each build
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(lambda index: self.rebuild(*index), indexes))
+            errors = [error for error in results if error is not None]
+
+            if analyze:
+                with conn.cursor() as cursor:
+                    for table_name in self.tables:
+                        cursor.execute(f"ANALYZE {table_name};")
+                conn.commit()
+        finally:
+            conn.close()
+
+        if indexes:
+            print(f"Rebuilt {len(indexes) - len(errors)} of {len(indexes)} indexes")
+        if errors:
+            raise errors[0]
+        return [index_name for index_name, _, _ in indexes]
+
+    # Function to build one index and remove its record in one transaction.
+    # Returns the error if it failed.
+    def rebuild(self, index_name, table_name, definition):
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(definition.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1) + ";")
+                cursor.execute(f"DELETE FROM {self.TABLE} WHERE index_name = %s;", (index_name,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Failed to rebuild index {index_name} on {table_name}: {str(e)}")
+            return e
+        finally:
+            conn.close()
+        return None
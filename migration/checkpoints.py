@@ -0,0 +1,88 @@
+import os
+import threading
+from psycopg2.extras import execute_values
+
+
+# Function to get the stable id the scraper gave a record, if it has one
+def source_id(record):
+    return record.get('exam_id')
+
+
+# Records which source ids are committed in a local file, one id per line.
+# Ids are appended and fsynced right after the database commit, so a crash in
+# between can at worst re-migrate the last batch; use the table journal when
+# that window matters.
+class FileCheckpointJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done_ids = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.done_ids.update(line.strip() for line in file if line.strip())
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def is_done(self, record_id):
+        return record_id in self.done_ids
+
+    # Nothing is written before the commit for a file journal
+    def stage(self, cursor, record_ids, source_file):
+        pass
+
+    # Function to record ids whose transaction has been committed
+    def confirm(self, record_ids):
+        with self.lock:
+            self.file.writelines(f"{record_id}\n" for record_id in record_ids)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.done_ids.update(record_ids)
+
+    def close(self):
+        self.file.close()
+
+
+# Records which source ids are committed in a database table, written in the
+# same transaction as the records themselves, so a record and its checkpoint
+# are either both committed or both rolled back.
+class TableCheckpointJournal:
+    TABLE = 'onlyedudb.migration_checkpoints'
+
+    def __init__(self, conn):
+        self.lock = threading.Lock()
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                source_id text PRIMARY KEY,
+                source_file text,
+                committed_at timestamp NOT NULL DEFAULT now()
+            );
+            """)
+            cursor.execute(f"SELECT source_id FROM {self.TABLE};")
+            self.done_ids = {record_id for (record_id,) in cursor.fetchall()}
+        conn.commit()
+
+    def is_done(self, record_id):
+        return record_id in self.done_ids
+
+    # Function to add checkpoint rows to the transaction about to be committed
+    def stage(self, cursor, record_ids, source_file):
+        if record_ids:
+            execute_values(cursor, f"""
+            INSERT INTO {self.TABLE} (source_id, source_file) VALUES %s
+            ON CONFLICT (source_id) DO NOTHING;
+            """, [(record_id, source_file) for record_id in record_ids], page_size=len(record_ids))
+
+    def confirm(self, record_ids):
+        with self.lock:
+            self.done_ids.update(record_ids)
+
+    def close(self):
+        pass
+
+
+# Function to open the journal named by --checkpoint: 'db' for the table
+# journal, anything else is taken as the path of a file journal
+def open_checkpoint_journal(checkpoint, conn):
+    if checkpoint == 'db':
+        return TableCheckpointJournal(conn)
+    return FileCheckpointJournal(checkpoint)
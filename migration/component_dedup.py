@@ -0,0 +1,69 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# Component rows remembered per run, about 100 bytes each
+MAX_ENTRIES = 200000
+
+
+# Function to hash the content of one component row together with where it
+# is stored. Rows are only shared between entities of the same link table and
+# component type, so deleting one entity's components never has to look at
+# the links of another table.
+def row_key(link_table, spec, row):
+    canonical = json.dumps([link_table, spec.table, spec.component_type, list(row)], ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest()
+
+
+# Remembers the id of committed component rows by content, so an identical
+# FAQ, highlight or section is linked again instead of inserted again. The
+# index is an LRU capped at max_entries: a row that was evicted is simply
+# inserted once more, so the cap costs some sharing, never correctness.
+# Shared by all workers of a run; only rows that are committed are added.
+class ComponentIndex:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max(max_entries, 1)
+        # key -> (table, id), least recently used first
+        self.rows = OrderedDict()
+        # (table, id) -> key, to forget deleted rows
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Function to get the id of a committed row with this key, or None
+    def get(self, key):
+        with self.lock:
+            row = self.rows.get(key)
+            if row is None:
+                return None
+            self.rows.move_to_end(key)
+            self.hits += 1
+            return row[1]
+
+    # Function to remember (key, table, id) entries once the transaction
+    # inserting their rows committed
+    def add(self, entries):
+        with self.lock:
+            for key, table, component_id in entries:
+                # Two workers may have inserted the same content; the last one wins
+                replaced = self.rows.get(key)
+                if replaced is not None:
+                    self.keys.pop(replaced, None)
+                self.rows[key] = (table, component_id)
+                self.rows.move_to_end(key)
+                self.keys[(table, component_id)] = key
+            while len(self.rows) > self.max_entries:
+                _, row = self.rows.popitem(last=False)
+                self.keys.pop(row, None)
+
+    # Function to forget deleted rows of a table so they are never linked again
+    def forget(self, table, component_ids):
+        with self.lock:
+            for component_id in component_ids:
+                key = self.keys.pop((table, component_id), None)
+                if key is not None:
+                    del self.rows[key]
@@ -0,0 +1,128 @@
+import tempfile
+
+# Rows are spooled in memory up to this size, then to a temporary file
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+# Function to encode one value for COPY's text format
+def copy_text(value):
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+# Function to encode one row as a line of COPY text format
+def copy_line(values):
+    return '\t'.join(copy_text(value) for value in values) + '\n'
+
+
+# Loads a whole file of records through temporary staging tables: every
+# parent row and component row is streamed in with COPY FROM STDIN, then a
+# handful of set-based INSERT ... SELECT statements fan them out into the
+# real tables, the *_components link table and, when given, the stream link
+# table, which may link one record to several streams. Ids are drawn from
+# each table's own sequence on the server, so the staging rows can be joined
+# to their parents without RETURNING.
+class CopyLoader:
+    def __init__(self, cursor, table, columns, link_table, specs, stream_link=None):
+        self.cursor = cursor
+        self.table = table
+        self.columns = columns
+        self.link_table = link_table
+        self.specs = specs
+        # (table, entity column, stream column) of the stream link table, if any
+        self.stream_link = stream_link
+
+    # Function to load records and return how many were staged. row(record)
+    # returns the values for self.columns and stream_ids(record), if given,
+    # the streams to link it to; a record whose row cannot be built is passed
+    # to on_error and skipped. Database errors propagate and leave the
+    # transaction to be rolled back by the caller.
+    def load(self, records, row, stream_ids=None, on_error=None):
+        entity_spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode='w+', encoding='utf-8')
+        component_spools = [tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode='w+', encoding='utf-8')
+                            for _ in self.specs]
+        try:
+            staged = 0
+            for src_key, record in enumerate(records):
+                try:
+                    streams = None
+                    if stream_ids is not None:
+                        # An integer[] in COPY text format
+                        streams = '{' + ','.join(str(stream_id) for stream_id in stream_ids(record)) + '}'
+                    entity_line = copy_line((src_key, streams) + tuple(row(record)))
+                    component_lines = [
+                        [copy_line((src_key, order) + tuple(values)) for order, values in enumerate(spec.rows(record))]
+                        for spec in self.specs
+                    ]
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    on_error(record, e)
+                    continue
+
+                entity_spool.write(entity_line)
+                for spool, lines in zip(component_spools, component_lines):
+                    spool.writelines(lines)
+                staged += 1
+
+            if staged:
+                self._create_staging_tables()
+                self._copy('stage_entities', ('src_key', 'stream_ids') + tuple(self.columns), entity_spool)
+                for index, (spec, spool) in enumerate(zip(self.specs, component_spools)):
+                    self._copy(f'stage_component_{index}', ('src_key', 'ord') + tuple(spec.columns), spool)
+                self._fan_out()
+            return staged
+        finally:
+            entity_spool.close()
+            for spool in component_spools:
+                spool.close()
+
+    def _create_staging_tables(self):
+        # Staging tables copy the column types of their targets and are dropped on commit
+        self.cursor.execute(f"""
+        CREATE TEMP TABLE stage_entities ON COMMIT DROP AS
+        SELECT {', '.join(self.columns)} FROM {self.table} WITH NO DATA;
+        ALTER TABLE stage_entities ADD COLUMN src_key integer, ADD COLUMN stream_ids integer[], ADD COLUMN entity_id bigint;
+        """)
+        for index, spec in enumerate(self.specs):
+            self.cursor.execute(f"""
+            CREATE TEMP TABLE stage_component_{index} ON COMMIT DROP AS
+            SELECT {', '.join(spec.columns)} FROM {spec.table} WITH NO DATA;
+            ALTER TABLE stage_component_{index} ADD COLUMN src_key integer, ADD COLUMN ord integer, ADD COLUMN component_id bigint;
+            """)
+
+    def _copy(self, staging_table, columns, spool):
+        spool.seek(0)
+        self.cursor.copy_expert(f"COPY {staging_table} ({', '.join(columns)}) FROM STDIN", spool)
+
+    def _fan_out(self):
+        self.cursor.execute(f"""
+        UPDATE stage_entities SET entity_id = nextval(pg_get_serial_sequence('{self.table}', 'id'));
+        INSERT INTO {self.table} (id, {', '.join(self.columns)})
+        SELECT entity_id, {', '.join(self.columns)} FROM stage_entities ORDER BY src_key;
+        """)
+
+        for index, spec in enumerate(self.specs):
+            columns = ', '.join(spec.columns)
+            self.cursor.execute(f"""
+            UPDATE stage_component_{index} SET component_id = nextval(pg_get_serial_sequence('{spec.table}', 'id'));
+            INSERT INTO {spec.table} (id, {columns})
+            SELECT component_id, {columns} FROM stage_component_{index} ORDER BY src_key, ord;
+            INSERT INTO {self.link_table} (entity_id, component_id, component_type, field)
+            SELECT e.entity_id, c.component_id, %s, %s
+            FROM stage_component_{index} c JOIN stage_entities e USING (src_key)
+            ORDER BY c.src_key, c.ord;
+            """, (spec.component_type, spec.field))
+
+        if self.stream_link:
+            link_table, entity_column, stream_column = self.stream_link
+            self.cursor.execute(f"""
+            INSERT INTO {link_table} ({entity_column}, {stream_column})
+            SELECT entity_id, unnest(stream_ids) FROM stage_entities
+            ON CONFLICT ({entity_column}, {stream_column}) DO NOTHING;
+            """)
@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+from datetime import datetime
+import psycopg2
+
+
+# Function to tell errors worth retrying as they are, such as a dropped
+# connection, a serialization failure or a deadlock, from errors in the data
+def is_transient(error):
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+# Function to build the dead-letter entry of one failed exam; stream_ids are
+# all the streams it is to be linked to, phase the step that failed and
+# record_key the key of its content hashes if the run used --delta, so
+# retry.py replays it through the same index
+def dead_letter(json_file, stream_ids, exam, error, phase, record_key=None):
+    return {
+        'file': json_file,
+        'stream_ids': list(stream_ids),
+        'exam': exam,
+        'delta': record_key is not None,
+        'record_key': record_key,
+        'error_class': type(error).__name__,
+        'error': str(error),
+        'transient': is_transient(error),
+        'phase': phase,
+        'failed_at': datetime.now().isoformat(timespec='seconds')
+    }
+
+
+# Appends every exam that failed to a JSON Lines file together with where it
+# came from, the class of the error and the phase it failed in, so retry.py
+# can load just those exams again. Shared by all workers of a run.
+class DeadLetterFile:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+        self.count = 0
+
+    def write(self, json_file, stream_ids, exam, error, phase, record_key=None):
+        line = json.dumps(dead_letter(json_file, stream_ids, exam, error, phase, record_key), ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+# Function to read the entries of a dead-letter file
+def read_dead_letters(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# Function to replace a dead-letter file with the given entries, atomically
+def rewrite_dead_letters(path, entries):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        for entry in entries:
+            file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    os.replace(temp_path, path)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import threading
+from psycopg2.extras import Json
+from slugify import slugify
+
+# Columns that differ on every run and must not make a record look changed
+VOLATILE_COLUMNS = ('slug', 'created_at', 'updated_at')
+
+
+# Function to drop the uuids the scrapers generate afresh on every crawl
+# (exam_id, faq_id, highlight_id, ...), which would otherwise change every hash
+def strip_volatile(value):
+    if isinstance(value, dict):
+        return {key: strip_volatile(item) for key, item in value.items() if not key.endswith('_id')}
+    if isinstance(value, (list, tuple)):
+        return [strip_volatile(item) for item in value]
+    return value
+
+
+# Function to hash any JSON-like value independently of key order
+def content_hash(value):
+    canonical = json.dumps(strip_volatile(value), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# Function to build the natural key of a record from its parts, e.g. the
+# stream id and exam name. Scraped uuids are not stable across crawls.
+def record_key(*parts):
+    return ':'.join(slugify(str(part)) for part in parts)
+
+
+# Stores a content hash per migrated record and per component field, so that a
+# re-run can tell new, unchanged and changed records apart and only rewrite
+# the parts of a changed record that actually differ.
+class DeltaIndex:
+    TABLE = 'onlyedudb.migration_content_hashes'
+
+    def __init__(self, conn, entity):
+        self.entity = entity
+        self.lock = threading.Lock()
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                entity text NOT NULL,
+                record_key text NOT NULL,
+                entity_id integer NOT NULL,
+                content_hash text NOT NULL,
+                part_hashes jsonb NOT NULL,
+                updated_at timestamp NOT NULL DEFAULT now(),
+                PRIMARY KEY (entity, record_key)
+            );
+            """)
+            cursor.execute(
+                f"SELECT record_key, entity_id, part_hashes FROM {self.TABLE} WHERE entity = %s;",
+                (entity,)
+            )
+            self.stored = {key: (entity_id, part_hashes) for key, entity_id, part_hashes in cursor.fetchall()}
+        conn.commit()
+
+    # Function to hash the parent row (without volatile columns) and the rows
+    # of every component field of one record, as its EntityMapping declares them
+    def part_hashes(self, mapping, record):
+        values = mapping.values(record, None)
+        parent = [value for column, value in zip(mapping.columns, values) if column not in VOLATILE_COLUMNS]
+        hashes = {'entity': content_hash(parent)}
+        for spec in mapping.components:
+            hashes[spec.field] = content_hash(spec.rows(record))
+        return hashes
+
+    # Function to classify a record as ('new', None, None),
+    # ('unchanged', entity_id, []) or ('changed', entity_id, changed parts)
+    def classify(self, key, hashes):
+        with self.lock:
+            stored = self.stored.get(key)
+        if stored is None:
+            return 'new', None, None
+        entity_id, stored_hashes = stored
+        changed = [part for part, value in hashes.items() if stored_hashes.get(part) != value]
+        return ('changed' if changed else 'unchanged'), entity_id, changed
+
+    # Function to save the hashes of a record in the transaction being built.
+    # Returns the entry to pass to confirm once that transaction is committed.
+    def stage(self, cursor, key, entity_id, hashes):
+        cursor.execute(f"""
+        INSERT INTO {self.TABLE} (entity, record_key, entity_id, content_hash, part_hashes)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (entity, record_key) DO UPDATE
+        SET entity_id = EXCLUDED.entity_id, content_hash = EXCLUDED.content_hash,
+            part_hashes = EXCLUDED.part_hashes, updated_at = now();
+        """, (self.entity, key, entity_id, content_hash(hashes), Json(hashes)))
+        return key, entity_id, hashes
+
+    # Function to make committed hashes visible to later records of the run
+    def confirm(self, entries):
+        with self.lock:
+            for key, entity_id, hashes in entries:
+                self.stored[key] = (entity_id, hashes)
+
+
+# Function to delete the component rows of one field of an entity, together
+# with their links, before the field is written again. Rows that other
+# entities still link to, which --dedup shares, are kept. Returns the ids of
+# the rows deleted.
+def delete_components(cursor, link_table, entity_id, spec):
+    cursor.execute(f"""
+    WITH removed AS (
+        DELETE FROM {link_table}
+        WHERE entity_id = %s AND field = %s AND component_type = %s
+        RETURNING id, component_id
+    )
+    DELETE FROM {spec.table} AS component
+    WHERE component.id IN (SELECT component_id FROM removed)
+    AND NOT EXISTS (
+        SELECT 1 FROM {link_table} AS link
+        WHERE link.component_id = component.id AND link.component_type = %s
+        AND link.id NOT IN (SELECT id FROM removed)
+    )
+    RETURNING component.id;
+    """, (entity_id, spec.field, spec.component_type, spec.component_type))
+    return [component_id for (component_id,) in cursor.fetchall()]
@@ -0,0 +1,251 @@
+import time
+from psycopg2.extras import execute_values
+from batch_writer import ComponentBatchWriter, insert_statement
+from copy_loader import CopyLoader
+from delta import delete_components
+from metrics import timed
+
+
+# Declares how one kind of scraped record is stored: the parent table and the
+# columns written to it, the record key its slug is built from, the
+# polymorphic components linked through link_table and, for exams, the table
+# linking an entity to its stream.
+class EntityMapping:
+    def __init__(self, name, table, columns, values, slug_source, link_table, components, stream_link=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        # values(record, slug) returns one value per column
+        self.values = values
+        # Record key of the title slugs are made from; None when the table has no slug
+        self.slug_source = slug_source
+        self.link_table = link_table
+        self.components = components
+        # (table, entity column, stream column) of the stream link table, if any
+        self.stream_link = stream_link
+
+    # Function to get the title of a record, as used for slugs and messages
+    def title(self, record):
+        return record.get(self.slug_source) if self.slug_source else None
+
+
+# Writes the entities of one mapping over one cursor: slugs from a shared
+# SlugRegistry, parent rows one at a time or many per statement, components
+# staged and flushed per batch by a ComponentBatchWriter, stream links, and
+# whole files through a CopyLoader. Every step can be timed on a PhaseTimer.
+# Committing is always left to the caller.
+#
+# With an IdAllocator, ids come from blocks reserved up front instead of
+# RETURNING id. Parent rows then need no reply to go on, so insert_many and
+# link_stream only queue their rows, and flush sends parents, stream links,
+# components and component links together in one round trip.
+#
+# With a ComponentIndex, components identical to one already written are
+# linked instead of inserted again. confirm must then be called after every
+# commit, so the rows it wrote can be shared.
+class EntityWriter:
+    def __init__(self, cursor, mapping, slug_registry=None, id_allocator=None, dedup=None):
+        self.cursor = cursor
+        self.mapping = mapping
+        self.slug_registry = slug_registry
+        self.id_allocator = id_allocator
+        # Statements and stream link rows waiting for the next flush
+        self.pending_statements = []
+        self.pending_links = []
+        self.component_writer = ComponentBatchWriter(cursor, mapping.link_table, mapping.components, id_allocator, dedup)
+        self.copy_loader = CopyLoader(
+            cursor, mapping.table, mapping.columns, mapping.link_table, mapping.components, mapping.stream_link
+        )
+
+    def __len__(self):
+        return len(self.component_writer)
+
+    # Function to take ids for count new rows of the parent table
+    def take_ids(self, count, timer=None):
+        with timed(timer, 'id_allocation'):
+            return self.id_allocator.take(self.cursor, {self.mapping.table: count})[self.mapping.table]
+
+    # Function to generate a unique slug for a record, or None without a registry
+    def generate_slug(self, record, timer=None):
+        if self.slug_registry is None:
+            return None
+        with timed(timer, 'slug'):
+            return self.slug_registry.generate(record[self.mapping.slug_source])
+
+    # Function to give back slugs whose rows were rolled back
+    def release_slugs(self, slugs):
+        if self.slug_registry is None:
+            return
+        for slug in slugs:
+            if slug:
+                self.slug_registry.release(slug)
+
+    # Function to insert one parent row and return its id and slug
+    def insert(self, record, timer=None):
+        columns = self.mapping.columns
+        if self.id_allocator is not None:
+            columns = ('id',) + tuple(columns)
+        query = f"""
+        INSERT INTO {self.mapping.table} ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        """
+        if self.id_allocator is None:
+            query += "RETURNING id"
+
+        slug = self.generate_slug(record, timer)
+        try:
+            values = self.mapping.values(record, slug)
+            if self.id_allocator is not None:
+                entity_id = self.take_ids(1, timer)[0]
+                values = (entity_id,) + tuple(values)
+            with timed(timer, f'{self.mapping.name}_insert', 1):
+                self.cursor.execute(query, values)
+        except Exception:
+            # The row is rolled back, so the slug is free again
+            self.release_slugs([slug])
+            raise
+        if self.id_allocator is None:
+            entity_id = self.cursor.fetchone()[0]
+        return entity_id, slug
+
+    # Function to insert many parent rows with one statement and return their
+    # (id, slug) pairs in the order of the records. With an IdAllocator the
+    # statement is queued for the next flush.
+    def insert_many(self, records, timer=None):
+        if not records:
+            return []
+        query = f"""
+        INSERT INTO {self.mapping.table} ({', '.join(self.mapping.columns)})
+        VALUES %s RETURNING id;
+        """
+        slugs = []
+        try:
+            rows = []
+            for record in records:
+                slug = self.generate_slug(record, timer)
+                slugs.append(slug)
+                rows.append(self.mapping.values(record, slug))
+            if self.id_allocator is not None:
+                ids = self.take_ids(len(rows), timer)
+                self.pending_statements.append(insert_statement(
+                    self.cursor, self.mapping.table, ('id',) + tuple(self.mapping.columns),
+                    [(entity_id,) + tuple(row) for entity_id, row in zip(ids, rows)]
+                ))
+                return list(zip(ids, slugs))
+            with timed(timer, f'{self.mapping.name}_insert', len(rows)):
+                # RETURNING yields ids in VALUES order, which pairs each id with its record
+                ids = execute_values(self.cursor, query, rows, page_size=len(rows), fetch=True)
+        except Exception:
+            self.release_slugs(slugs)
+            raise
+        return [(entity_id, slug) for (entity_id,), slug in zip(ids, slugs)]
+
+    # Function to update the columns of an existing row whose content changed
+    def update(self, entity_id, record, timer=None):
+        columns = [column for column in self.mapping.columns if column not in ('slug', 'created_at')]
+        values = [value for column, value in zip(self.mapping.columns, self.mapping.values(record, None))
+                  if column in columns]
+        query = f"""
+        UPDATE {self.mapping.table} SET {', '.join(f'{column} = %s' for column in columns)}
+        WHERE id = %s;
+        """
+        with timed(timer, f'{self.mapping.name}_update', 1):
+            self.cursor.execute(query, values + [entity_id])
+
+    # Function to link an entity to a stream. With an IdAllocator the link is
+    # queued for the next flush.
+    def link_stream(self, entity_id, stream_id, timer=None):
+        if self.id_allocator is not None:
+            self.pending_links.append((entity_id, stream_id))
+            return
+        link_table, entity_column, stream_column = self.mapping.stream_link
+        query = f"""
+        INSERT INTO {link_table} ({entity_column}, {stream_column})
+        VALUES (%s, %s) ON CONFLICT ({entity_column}, {stream_column}) DO NOTHING;
+        """
+        with timed(timer, 'stream_link', 1):
+            self.cursor.execute(query, (entity_id, stream_id))
+
+    # Function to stage the components of one entity, or only those of the
+    # given specs; they are written by flush
+    def add_components(self, entity_id, record, specs=None, timer=None):
+        with timed(timer, 'component_staging'):
+            self.component_writer.add(entity_id, record, specs)
+
+    # Function to delete the components of the given specs before they are
+    # written again
+    def delete_components(self, entity_id, specs, timer=None):
+        with timed(timer, 'components_delete'):
+            for spec in specs:
+                deleted = delete_components(self.cursor, self.mapping.link_table, entity_id, spec)
+                self.component_writer.forget(spec.table, deleted)
+
+    # Function to write everything staged and return the number of component
+    # links written
+    def flush(self, timer=None):
+        if self.id_allocator is None:
+            return self.component_writer.flush(timer)
+
+        statements = list(self.pending_statements)
+        if self.pending_links:
+            link_table, entity_column, stream_column = self.mapping.stream_link
+            # Sent with the rest in bulk_write; timed here while it is rendered
+            with timed(timer, 'stream_link', len(self.pending_links)):
+                statements.append(
+                    insert_statement(self.cursor, link_table, (entity_column, stream_column), self.pending_links)
+                    + f" ON CONFLICT ({entity_column}, {stream_column}) DO NOTHING".encode('utf-8')
+                )
+        component_statements, link_count = self.component_writer.statements(timer)
+        statements += component_statements
+        self.pending_statements.clear()
+        self.pending_links.clear()
+
+        if statements:
+            with timed(timer, 'bulk_write', link_count):
+                self.cursor.execute(b';\n'.join(statements))
+        return link_count
+
+    # Function to make what the last commit wrote available for dedup
+    def confirm(self):
+        self.component_writer.confirm()
+
+    def clear(self):
+        self.pending_statements.clear()
+        self.pending_links.clear()
+        self.component_writer.clear()
+
+    # Function to drop the queued components and stream links of one entity
+    # whose savepoint was rolled back, so the next flush does not write them
+    def discard(self, entity_id):
+        self.pending_links[:] = [link for link in self.pending_links if link[0] != entity_id]
+        self.component_writer.discard(entity_id)
+
+    # Function to load records with COPY through staging tables, linking each
+    # one to the streams stream_ids(record) returns, if given. Records whose
+    # row cannot be built go to on_error and are skipped. Returns the records
+    # staged and their slugs, which the caller must release if its commit
+    # fails; if the load itself fails the slugs are released here.
+    def copy(self, records, stream_ids=None, on_error=None, timer=None):
+        slugs = {}
+        staged = {}
+
+        def row(record):
+            slug = self.generate_slug(record, timer)
+            slugs[id(record)] = slug
+            staged[id(record)] = record
+            return self.mapping.values(record, slug)
+
+        def failed(record, error):
+            staged.pop(id(record), None)
+            self.release_slugs([slugs.pop(id(record), None)])
+            on_error(record, error)
+
+        try:
+            started = time.perf_counter()
+            count = self.copy_loader.load(records, row, stream_ids, failed if on_error else None)
+            if timer is not None:
+                timer.add('copy_load', time.perf_counter() - started, count)
+        except Exception:
+            self.release_slugs(slugs.values())
+            raise
+        return list(staged.values()), list(slugs.values())
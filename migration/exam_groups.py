@@ -0,0 +1,64 @@
+from checkpoints import source_id
+from delta import content_hash, record_key
+
+
+# Function to rate how complete the copy of an exam is: the number of
+# component rows the mapping would write for it, or -1 if it cannot be
+# mapped at all
+def completeness(mapping, exam):
+    try:
+        mapping.values(exam, None)
+        return sum(len(spec.rows(exam)) for spec in mapping.components)
+    except Exception:
+        return -1
+
+
+# Function to identify one copy of an exam among all the stream files
+def copy_id(exam):
+    return source_id(exam) or content_hash(exam)
+
+
+# Groups the exams of every stream file by normalized name, so an exam that
+# several streams list (e.g. CLAT under law and university) is inserted once
+# and linked to all of them. The most complete copy is the one migrated;
+# only keys, ids and stream ids are kept, not the exams themselves.
+class ExamGroups:
+    def __init__(self, mapping):
+        self.mapping = mapping
+        # key -> [id of the chosen copy, its completeness, stream ids in order]
+        self.groups = {}
+
+    # Function to build the groups from (stream_id, exams) pairs in a pre-pass
+    # over every stream file
+    @classmethod
+    def scan(cls, mapping, streams):
+        groups = cls(mapping)
+        for stream_id, exams in streams:
+            for exam in exams:
+                groups.add(exam, stream_id)
+        return groups
+
+    def add(self, exam, stream_id):
+        key = record_key(exam['exam_name'])
+        score = completeness(self.mapping, exam)
+        group = self.groups.get(key)
+        if group is None:
+            self.groups[key] = [copy_id(exam), score, [stream_id]]
+            return
+        # Ties keep the copy seen first
+        if score > group[1]:
+            group[0], group[1] = copy_id(exam), score
+        if stream_id not in group[2]:
+            group[2].append(stream_id)
+
+    # Function to tell whether this copy of an exam is the one to migrate.
+    # Exams the pre-pass did not see are migrated as they are.
+    def is_chosen(self, exam):
+        group = self.groups.get(record_key(exam['exam_name']))
+        return group is None or group[0] == copy_id(exam)
+
+    # Function to get every stream an exam is listed under, or only the given
+    # one for exams the pre-pass did not see
+    def stream_ids(self, exam, stream_id):
+        group = self.groups.get(record_key(exam['exam_name']))
+        return list(group[2]) if group is not None else [stream_id]
@@ -0,0 +1,66 @@
+import threading
+from collections import defaultdict, deque
+
+# Ids reserved per table whenever a table's pool runs dry
+BLOCK_SIZE = 1000
+
+
+# Reserves ids from the serial sequences of many tables in one round trip and
+# hands them out client-side, so parents, components and link rows can be
+# written in independent bulk statements instead of waiting for RETURNING id.
+# Sequences are not transactional: ids of rolled-back rows are simply never
+# used, leaving gaps like any failed insert does. Shared by all workers.
+class IdAllocator:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = max(block_size, 1)
+        self.pools = defaultdict(deque)
+        self.lock = threading.Lock()
+
+    # Function to take count ids for each table in counts ({table: count}).
+    # Tables whose pool is short are refilled together with one query.
+    def take(self, cursor, counts):
+        with self.lock:
+            short = self.shortfall(counts)
+            if short:
+                cursor.execute(*reservation_query(short))
+                self.store(cursor.fetchall())
+            return self.pop(counts)
+
+    # Same as take over a psycopg 3 AsyncCursor. Meant for an allocator owned
+    # by one event loop: the lock is not held while the query is awaited.
+    async def take_async(self, cursor, counts):
+        short = self.shortfall(counts)
+        if short:
+            await cursor.execute(*reservation_query(short))
+            self.store(await cursor.fetchall())
+        with self.lock:
+            return self.pop(counts)
+
+    # Function to work out how many ids to reserve for each table whose pool
+    # cannot cover counts
+    def shortfall(self, counts):
+        return {
+            table: max(count - len(self.pools[table]), self.block_size)
+            for table, count in counts.items() if len(self.pools[table]) < count
+        }
+
+    def store(self, rows):
+        for table, entity_id in rows:
+            self.pools[table].append(entity_id)
+
+    def pop(self, counts):
+        return {
+            table: [self.pools[table].popleft() for _ in range(count)]
+            for table, count in counts.items()
+        }
+
+
+# Function to build the query reserving counts ({table: count}) ids, which
+# returns one (table, id) row per id
+def reservation_query(counts):
+    values = ', '.join(['(%s, %s)'] * len(counts))
+    params = [value for table, count in counts.items() for value in (table, count)]
+    return f"""
+    SELECT t.name, nextval(pg_get_serial_sequence(t.name, 'id'))
+    FROM (VALUES {values}) AS t(name, n), generate_series(1, t.n);
+    """, params
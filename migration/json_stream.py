@@ -0,0 +1,101 @@
+import json
+import re
+
+# Characters read from the file at a time
+READ_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r\ufeff'
+
+# Characters that can follow a number or literal inside an array
+SCALAR_END = re.compile(r'[\s,\]]')
+
+decoder = json.JSONDecoder()
+
+
+# Function to yield the items of a top-level JSON array one at a time. Only
+# the item being decoded and one read buffer are held in memory, so memory
+# stays flat however large the file gets. Raises json.JSONDecodeError when
+# the file is not a well-formed array.
+def iter_json_array(file, read_size=READ_SIZE):
+    buffer = ''
+    position = 0
+    at_eof = False
+
+    # Function to read more of the file, dropping what has been consumed
+    def read_more(size):
+        nonlocal buffer, position, at_eof
+        chunk = file.read(size)
+        if not chunk:
+            at_eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    # Function to skip whitespace and return the next character ('' at the end)
+    def next_char():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position < len(buffer) or at_eof:
+                return buffer[position] if position < len(buffer) else ''
+            read_more(read_size)
+
+    if next_char() != '[':
+        raise json.JSONDecodeError("Expecting a top-level array", buffer, position)
+    position += 1
+
+    first = True
+    while True:
+        char = next_char()
+        if char == ']':
+            position += 1
+            if next_char() != '':
+                raise json.JSONDecodeError("Extra data after the top-level array", buffer, position)
+            return
+        if not first:
+            if char != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+            position += 1
+            next_char()
+
+        # Decode the next item, reading more until it is complete. A number or
+        # literal is only decoded once the character after it is in the
+        # buffer, since a number cut after '.', 'e' or '-' would decode as its
+        # first part. An item that ends exactly at the end of the buffer reads
+        # more too.
+        size = read_size
+        while True:
+            if (not at_eof and position < len(buffer) and buffer[position] not in '{["'
+                    and not SCALAR_END.search(buffer, position)):
+                read_more(size)
+                size *= 2
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                if end < len(buffer) or at_eof:
+                    break
+            except json.JSONDecodeError:
+                if at_eof:
+                    raise
+            read_more(size)
+            size *= 2
+
+        position = end
+        first = False
+        yield item
+
+
+# Function to yield the items of a JSON Lines file one at a time, skipping
+# blank lines
+def iter_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+# Function to stream the records of a scraper output file: JSON Lines for
+# .jl/.jsonl files, otherwise a top-level JSON array
+def iter_json_records(file, path):
+    if path.endswith(('.jl', '.jsonl')):
+        return iter_json_lines(file)
+    return iter_json_array(file)
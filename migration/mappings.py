@@ -0,0 +1,252 @@
+import json
+from datetime import datetime
+from batch_writer import ComponentSpec
+from entity_mapping import EntityMapping
+
+# Where every scraped entity is stored, declared once for all the migration
+# scripts. A component field maps a list in the record to a component table
+# and the component_type/field of its link rows.
+
+
+# Function to convert array to HTML <ul> list
+def convert_array_to_html_list(array):
+    html_list = "<ul>"
+    for item in array:
+        html_list += f"<li>{item}</li>"
+    html_list += "</ul>"
+    return html_list
+
+# Helper function to handle 'N/A' or missing data
+def sanitize_data(value, data_type=None):
+    if value in ['N/A', '', None]:
+        return None
+    if data_type == 'integer' and isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return value
+
+# Function to map the documents required of an exam to (heading, content)
+# rows. Most scraped files hold a list of headed document lists; exams from
+# Career360Spider hold the whole tab as one block of HTML instead, an object
+# with html_content, which is kept as it is, without a heading.
+def document_rows(exam):
+    documents = exam.get('documents_required', [])
+    if isinstance(documents, dict):
+        content = sanitize_data(documents.get('html_content', None))
+        return [(None, content)] if content else []
+    return [
+        (document.get('heading', None), convert_array_to_html_list(document.get('documents', [])))
+        for document in documents
+    ]
+
+
+# Components shared by several entities
+HIGHLIGHTS_TABLE = 'onlyedudb.components_exam_components_exam_highlights_tables'
+FAQS_TABLE = 'onlyedudb.components_exam_components_faqs'
+SECTIONS_TABLE = 'onlyedudb.components_course_compoents_sections'
+
+FAQ_COMPONENT = ComponentSpec(
+    FAQS_TABLE, ('question', 'answer'),
+    'global.faq', 'faq',
+    lambda record: [(faq.get('question', None), faq.get('answer', None)) for faq in record.get('faqs', [])]
+)
+
+SECTION_COMPONENT = ComponentSpec(
+    SECTIONS_TABLE, ('title', 'content'),
+    'section', 'sections',
+    lambda record: [(section.get('title', None), section.get('content', None)) for section in record.get('sections', [])]
+)
+
+
+# Exams, as written by MigrateExam2.py and MigrateExamNew.py
+
+# Function to map an exam to the values of its columns
+def exam_values(exam, slug):
+    return (
+        exam['exam_name'],
+        slug,
+        exam['conducting_body'],
+        exam['accepting_colleges'],
+        sanitize_data(exam['total_applications'], 'integer'),
+        exam['exam_type'],
+        exam['exam_level'],
+        json.dumps(exam['syllabus']),
+        datetime.now(),
+        datetime.now()
+    )
+
+EXAM_MAPPING = EntityMapping(
+    'exam', 'onlyedudb.exams',
+    ('title', 'slug', 'conducting_body', 'accepting_colleges', 'total_applications',
+     'exam_type', 'exam_level', 'syllabus', 'created_at', 'updated_at'),
+    exam_values, 'exam_name', 'onlyedudb.exams_components',
+    [
+        ComponentSpec(
+            HIGHLIGHTS_TABLE, ('key', 'value'),
+            'highlight', 'highlights',
+            lambda exam: [(highlight['key'], highlight['value']) for highlight in exam.get('highlights', [])]
+        ),
+        FAQ_COMPONENT,
+        ComponentSpec(
+            'onlyedudb.components_exam_components_doc_reqs', ('title', 'content'),
+            'exam-components.doc-req', 'doc_req',
+            # Convert each documents array to an HTML list
+            document_rows
+        ),
+        SECTION_COMPONENT,
+    ],
+    stream_link=('onlyedudb.exams_stream_links', 'exam_id', 'stream_id')
+)
+
+
+# Exams in the earlier schema without slugs, where each tab was a column,
+# as written by MigrateExams.py and NEW.PY
+
+# Function to map an exam to the values of its legacy columns
+def legacy_exam_values(exam, slug):
+    # Handle 'N/A' or invalid integer values by setting them to zero
+    total_applications = exam.get('total_applications', '0')
+    if not total_applications.isdigit():
+        total_applications = 0
+
+    return (
+        exam.get('exam_name', None),
+        exam.get('conducting_body', None),
+        exam.get('accepting_colleges', None),
+        int(total_applications),
+        exam.get('about_exam', {}).get('description', None),
+        json.dumps(exam.get('syllabus', [])),
+        exam.get('eligibility_criteria', {}).get('html_content', None),
+        exam.get('application_process', {}).get('html_content', None),
+        exam.get('preparation_tips', {}).get('html_content', None),
+        exam.get('admit_card', {}).get('html_content', None),
+        exam.get('cutoffs', {}).get('html_content', None),
+        exam.get('counselling_process', {}).get('html_content', None),
+        exam.get('exam_type', None),
+        exam.get('exam_level', None),
+        datetime.now(),
+        datetime.now(),
+        exam.get('exam_pattern', {}).get('html_content', None)
+    )
+
+LEGACY_EXAM_MAPPING = EntityMapping(
+    'exam', 'onlyedudb.exams',
+    ('title', 'conducting_body', 'accepting_colleges', 'total_applications', 'about_exam', 'syllabus',
+     'eligibility_criteria', 'application_process', 'preparation_tips', 'admit_card', 'cut_off',
+     'counselling_process', 'exam_type', 'exam_level', 'created_at', 'updated_at', 'exam_pattern'),
+    legacy_exam_values, None, 'onlyedudb.exams_components',
+    [
+        ComponentSpec(
+            HIGHLIGHTS_TABLE, ('key', 'value'),
+            'exam-components.exam-highlights-table', 'highlights',
+            lambda exam: [(highlight.get('key', None), highlight.get('value', None)) for highlight in exam.get('highlights', [])]
+        ),
+        ComponentSpec(
+            'onlyedudb.components_exam_components_documents_requireds', ('title', 'documents'),
+            'exam-components.documents-required', 'documents_required',
+            document_rows
+        ),
+        FAQ_COMPONENT,
+    ],
+    stream_link=('onlyedudb.exams_stream_links', 'exam_id', 'stream_id')
+)
+
+
+# Courses, as written by Course/course_migration/migration.py
+
+# Function to map a course to the values of its columns, with None defaults
+def course_values(course, slug):
+    return (
+        course.get('title', None),
+        slug,
+        course.get('average_duration', None),
+        course.get('average_fees', None),
+        course.get('description', None),
+        datetime.now(),
+        datetime.now()
+    )
+
+COURSE_MAPPING = EntityMapping(
+    'course', 'onlyedudb.coursees',
+    ('title', 'slug', 'average_duration', 'average_fees', 'description', 'created_at', 'updated_at'),
+    course_values, 'title', 'onlyedudb.coursees_components',
+    [SECTION_COMPONENT, FAQ_COMPONENT]
+)
+
+
+# Colleges, as written by MigrateColleges.py
+
+# Function to map a college to the values of its columns
+def college_values(college, slug):
+    return (
+        college['title'],
+        slug,
+        college.get('city'),
+        college.get('state'),
+        college.get('ownership'),
+        college.get('ranking'),
+        college.get('rank_publisher'),
+        college.get('fees'),
+        college.get('accreditation'),
+        college.get('avg_package'),
+        json.dumps(college.get('exams', [])),
+        college.get('description'),
+        datetime.now(),
+        datetime.now()
+    )
+
+# Function to list the sub-navigation tabs of a college. The spider stores
+# each one under '<tab name>Tab'; the overview tab is a list of its own.
+def college_tabs(college):
+    return [
+        value for key, value in college.items()
+        if key.endswith('Tab') and key != 'overviewTab' and isinstance(value, dict)
+    ]
+
+COLLEGE_MAPPING = EntityMapping(
+    'college', 'onlyedudb.colleges',
+    ('title', 'slug', 'city', 'state', 'ownership', 'ranking', 'rank_publisher', 'fees',
+     'accreditation', 'avg_package', 'exams', 'description', 'created_at', 'updated_at'),
+    college_values, 'title', 'onlyedudb.colleges_components',
+    [
+        ComponentSpec(
+            SECTIONS_TABLE, ('title', 'content'),
+            'section', 'overview',
+            lambda college: [(block.get('title'), block.get('content')) for block in college.get('overviewTab', [])]
+        ),
+        ComponentSpec(
+            HIGHLIGHTS_TABLE, ('key', 'value'),
+            'highlight', 'highlights',
+            lambda college: list(college.get('highlights', {}).items())
+        ),
+        ComponentSpec(
+            'onlyedudb.components_college_components_courses',
+            ('course_title', 'fees', 'duration', 'study_mode', 'eligibility', 'offered_courses'),
+            'college-components.course', 'courses',
+            lambda college: [
+                (course.get('course_title'), course.get('fees'), course.get('duration'), course.get('study_mode'),
+                 course.get('eligibility'), json.dumps(course.get('offered_courses', [])))
+                for course in college.get('courses', [])
+            ]
+        ),
+        FAQ_COMPONENT,
+        ComponentSpec(
+            'onlyedudb.components_college_components_tab_sections', ('tab', 'title', 'content'),
+            'college-components.tab-section', 'tabs',
+            lambda college: [
+                (tab.get('tab'), block.get('title'), block.get('content'))
+                for tab in college_tabs(college) for block in tab.get('content', [])
+            ]
+        ),
+        ComponentSpec(
+            'onlyedudb.components_college_components_facilities', ('tab', 'name'),
+            'college-components.facility', 'facilities',
+            lambda college: [
+                (tab.get('tab'), facility)
+                for tab in college_tabs(college) for facility in tab.get('facilities') or []
+            ]
+        ),
+    ]
+)
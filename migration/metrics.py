@@ -0,0 +1,120 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+# Function to pick the p-th percentile of sorted values (nearest rank)
+def percentile(values, p):
+    if not values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+# Collects the time spent in each phase of a run (JSON parse, slug
+# generation, exam insert, each component type, stream linking, commit...)
+# from every worker. Each timed unit, an exam or a batch, can be written as
+# one JSON line to a metrics file; the aggregate is printed as a table with
+# p50/p95/p99 latencies and rows/sec per phase at the end of the run.
+class MigrationMetrics:
+    def __init__(self, path=None):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+        self.started = time.monotonic()
+        self.durations = defaultdict(list)
+        self.rows = defaultdict(int)
+
+    # Function to start timing one exam or batch
+    def timer(self):
+        return PhaseTimer(self)
+
+    def record(self, phase, seconds, rows=0):
+        with self.lock:
+            self.durations[phase].append(seconds)
+            self.rows[phase] += rows
+
+    # Function to write one event as a line of the metrics file, if there is one
+    def emit(self, event):
+        if self.file is None:
+            return
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+
+    # Function to summarise every phase as
+    # {phase: {count, seconds, p50_ms, p95_ms, p99_ms, rows, rows_per_sec}}
+    def summary(self):
+        with self.lock:
+            phases = {phase: sorted(durations) for phase, durations in self.durations.items()}
+            rows = dict(self.rows)
+        summary = {}
+        for phase, durations in phases.items():
+            seconds = sum(durations)
+            summary[phase] = {
+                'count': len(durations),
+                'seconds': seconds,
+                'p50_ms': percentile(durations, 50) * 1000,
+                'p95_ms': percentile(durations, 95) * 1000,
+                'p99_ms': percentile(durations, 99) * 1000,
+                'rows': rows[phase],
+                'rows_per_sec': rows[phase] / seconds if seconds else 0.0,
+            }
+        return summary
+
+    # Function to print the end-of-run table, slowest phase first, and add it
+    # to the metrics file
+    def report(self, stats, unit='exams'):
+        summary = self.summary()
+        elapsed = time.monotonic() - self.started
+        self.emit({'event': 'run', 'elapsed_seconds': elapsed, 'stats': stats, 'phases': summary})
+
+        print("\nPhase Timings:")
+        print("=" * 50)
+        print(f"{'phase':<28} {'count':>8} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rows':>9} {'rows/s':>10}")
+        for phase, entry in sorted(summary.items(), key=lambda item: item[1]['seconds'], reverse=True):
+            print(f"{phase:<28} {entry['count']:>8} {entry['seconds']:>9.2f} {entry['p50_ms']:>9.2f} "
+                  f"{entry['p95_ms']:>9.2f} {entry['p99_ms']:>9.2f} {entry['rows']:>9} {entry['rows_per_sec']:>10.1f}")
+        migrated = stats.get('successful_migrations', 0)
+        print(f"Wall time: {elapsed:.2f}s, {migrated / elapsed if elapsed else 0.0:.1f} {unit}/sec")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+# Times the phases of one exam or batch. Every phase is added to the run's
+# aggregate as it finishes; emit writes the unit's own totals as one event.
+class PhaseTimer:
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.seconds = defaultdict(float)
+        self.rows = defaultdict(int)
+
+    @contextmanager
+    def phase(self, name, rows=0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, rows)
+
+    def add(self, name, seconds, rows=0):
+        self.seconds[name] += seconds
+        self.rows[name] += rows
+        self.metrics.record(name, seconds, rows)
+
+    def emit(self, event, **fields):
+        fields = {'event': event, **fields}
+        fields['phases_ms'] = {name: round(seconds * 1000, 3) for name, seconds in self.seconds.items()}
+        fields['rows'] = {name: rows for name, rows in self.rows.items() if rows}
+        self.metrics.emit(fields)
+
+
+# Function to time a phase on a timer that may be None
+def timed(timer, name, rows=0):
+    if timer is None:
+        return nullcontext()
+    return timer.phase(name, rows)
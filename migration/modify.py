@@ -1,78 +1,66 @@
 import json
+from json_stream import iter_json_array
 
-def restructure_json(input_file, output_file):
-    with open(input_file, 'r', encoding='utf-8') as file:
-        exams = json.load(file)
-    
-    modified_exams = []
-    
-    for exam in exams:
-        # Create the sections array
-        sections = []
-        
-        # Add each section if available in the JSON
-        if 'about_exam' in exam and 'description' in exam['about_exam']:
-            sections.append({
-                "title": "About",
-                "content": exam['about_exam']['description']
-            })
-        
-        if 'eligibility_criteria' in exam and 'html_content' in exam['eligibility_criteria']:
-            sections.append({
-                "title": "Eligibility Criteria",
-                "content": exam['eligibility_criteria']['html_content']
-            })
-        
-        if 'application_process' in exam and 'html_content' in exam['application_process']:
-            sections.append({
-                "title": "Application Process",
-                "content": exam['application_process']['html_content']
-            })
-        
-        if 'preparation_tips' in exam and 'html_content' in exam['preparation_tips']:
-            sections.append({
-                "title": "Preparation Tips",
-                "content": exam['preparation_tips']['html_content']
-            })
-        
-        if 'admit_card' in exam and 'html_content' in exam['admit_card']:
-            sections.append({
-                "title": "Admit Card",
-                "content": exam['admit_card']['html_content']
-            })
-        
-        if 'cutoffs' in exam and 'html_content' in exam['cutoffs']:
-            sections.append({
-                "title": "Cut Off",
-                "content": exam['cutoffs']['html_content']
-            })
-        
-        if 'counselling_process' in exam and 'html_content' in exam['counselling_process']:
-            sections.append({
-                "title": "Counselling Process",
-                "content": exam['counselling_process']['html_content']
-            })
-        
-        if 'Exam_Pattern' in exam and 'html_content' in exam['Exam_Pattern']:
+# Fields of the old scraped shape that become sections, with their titles, in
+# the order the sections are listed
+SECTION_FIELDS = [
+    ('about_exam', 'description', "About"),
+    ('eligibility_criteria', 'html_content', "Eligibility Criteria"),
+    ('application_process', 'html_content', "Application Process"),
+    ('preparation_tips', 'html_content', "Preparation Tips"),
+    ('admit_card', 'html_content', "Admit Card"),
+    ('cutoffs', 'html_content', "Cut Off"),
+    ('counselling_process', 'html_content', "Counselling Process"),
+    ('Exam_Pattern', 'html_content', "Exam Pattern"),
+]
+
+# Function to tell an exam in the old scraped shape, with one field per tab,
+# from one already restructured into sections
+def is_old_shape(exam):
+    return any(field in exam for field, _, _ in SECTION_FIELDS)
+
+# Function to restructure one exam: build the sections array from the old
+# tab fields and remove them. Exams already in the new shape are returned
+# as they are.
+def restructure_exam(exam):
+    if not is_old_shape(exam):
+        return exam
+
+    # Create the sections array, adding each section if available in the JSON
+    sections = []
+    for field, content_key, title in SECTION_FIELDS:
+        if field in exam and content_key in exam[field]:
             sections.append({
-                "title": "Exam Pattern",
-                "content": exam['Exam_Pattern']['html_content']
+                "title": title,
+                "content": exam[field][content_key]
             })
-        
-        # Add the sections array to the exam
-        exam['sections'] = sections
-        
-        # Remove the old individual section fields
-        for key in ['about_exam', 'eligibility_criteria', 'application_process', 'preparation_tips', 'admit_card', 'cutoffs', 'counselling_process', 'Exam_Pattern']:
-            if key in exam:
-                del exam[key]
-        
-        # Add the modified exam to the list
-        modified_exams.append(exam)
-    
+
+    # Add the sections array to the exam
+    exam['sections'] = sections
+
+    # Remove the old individual section fields
+    for field, _, _ in SECTION_FIELDS:
+        if field in exam:
+            del exam[field]
+    return exam
+
+# Function to restructure a stream of exams one at a time, as a transform
+# stage in front of a loader
+def restructure_exams(exams):
+    for exam in exams:
+        yield restructure_exam(exam)
+
+# Function to write a restructured copy of a scraped file. The loaders apply
+# restructure_exams themselves; this is only needed to inspect the result.
+def restructure_json(input_file, output_file):
+    with open(input_file, 'r', encoding='utf-8') as file:
+        modified_exams = list(restructure_exams(iter_json_array(file)))
+
     # Write the modified exams to a new JSON file
     with open(output_file, 'w', encoding='utf-8') as file:
         json.dump(modified_exams, file, ensure_ascii=False, indent=4)
 
-# Usage example
-restructure_json('../Exams/exams_data/example.json', 'm_example.json')
+
+if __name__ == '__main__':
+    # Usage example
+    restructure_json('../Exams/exams_data/example.json', 'm_example.json')
@@ -0,0 +1,201 @@
+import asyncio
+from collections import defaultdict
+from itertools import islice
+import psycopg  # psycopg 3, for its asyncio connection and pipeline mode
+from batch_writer import LINK_COLUMNS
+from id_allocator import IdAllocator
+from metrics import MigrationMetrics
+
+# Batches prepared ahead of the one being written
+QUEUE_SIZE = 4
+
+
+# Function to build an INSERT with one placeholder per column
+def insert_query(table, columns, suffix=''):
+    return f"""
+    INSERT INTO {table} ({', '.join(columns)})
+    VALUES ({', '.join(['%s'] * len(columns))}){suffix};
+    """
+
+
+# One record ready to be written: its slug, its column values and the rows
+# of each of its components
+class PreparedRecord:
+    def __init__(self, record, slug, values, components):
+        self.record = record
+        self.slug = slug
+        self.values = values
+        self.components = components
+
+
+# Writes a stream of records as a mapping declares, with psycopg 3 on one
+# asyncio connection. A worker thread reads and transforms the next batches
+# while the current one is written; QUEUE_SIZE bounds how far it runs ahead.
+# Every batch is sent in pipeline mode, its parent rows, stream links,
+# components, component links and COMMIT together, so it costs one round
+# trip however many statements it has. Ids come from an IdAllocator because
+# nothing in flight can wait for RETURNING id.
+#
+# The rows written are the same as EntityWriter's. A batch that fails is
+# rolled back and replayed one record at a time with the same slugs and
+# ids, so one bad record only fails itself.
+class PipelinedWriter:
+    def __init__(self, conninfo, mapping, slug_registry=None, batch_size=50, queue_size=QUEUE_SIZE, metrics=None):
+        self.conninfo = conninfo
+        self.mapping = mapping
+        self.slug_registry = slug_registry
+        self.batch_size = max(batch_size, 1)
+        self.queue_size = max(queue_size, 1)
+        self.metrics = metrics if metrics is not None else MigrationMetrics()
+        # Owned by this writer's event loop only
+        self.id_allocator = IdAllocator()
+        self.stats = {'successful_migrations': 0, 'failed_migrations': 0}
+        self.failed_records = []
+
+    # Function to write every record, linking each one to stream_id if given.
+    # Returns the statistics of the run.
+    def run(self, records, stream_id=None):
+        return asyncio.run(self.write_all(records, stream_id))
+
+    async def write_all(self, records, stream_id=None):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        producer = asyncio.create_task(self.produce(iter(records), queue))
+        try:
+            async with await psycopg.AsyncConnection.connect(**self.conninfo) as conn:
+                while True:
+                    batch = await queue.get()
+                    if batch is None:
+                        break
+                    await self.write_batch(conn, batch, stream_id)
+        finally:
+            if not producer.done():
+                producer.cancel()
+        # Re-raises a read error of the producer, such as invalid JSON
+        await producer
+        return self.stats
+
+    # Function to read and transform batches in a worker thread and queue them
+    # for the writer, waiting while the queue is full. None marks the end.
+    async def produce(self, records, queue):
+        try:
+            while True:
+                batch = await asyncio.to_thread(self.prepare_batch, records)
+                await queue.put(batch)
+                if batch is None:
+                    return
+        except Exception:
+            # Batches read before the error are still written
+            await queue.put(None)
+            raise
+
+    # Function to read the next batch of records and build its rows. Runs in
+    # a worker thread; records that cannot be mapped are returned with their
+    # errors, to be recorded by the writer.
+    def prepare_batch(self, records):
+        timer = self.metrics.timer()
+        with timer.phase('parse'):
+            records = list(islice(records, self.batch_size))
+        prepared = []
+        failed = []
+        with timer.phase('transform', len(records)):
+            for record in records:
+                slug = None
+                try:
+                    if self.slug_registry is not None:
+                        slug = self.slug_registry.generate(record[self.mapping.slug_source])
+                    components = [(spec, spec.rows(record)) for spec in self.mapping.components]
+                    prepared.append(PreparedRecord(record, slug, self.mapping.values(record, slug), components))
+                except Exception as e:
+                    self.release_slug(slug)
+                    failed.append((record, e))
+        return (prepared, failed, timer) if records else None
+
+    # Function to write one prepared batch and commit it, replaying its
+    # records one at a time if it fails as a whole
+    async def write_batch(self, conn, batch, stream_id):
+        prepared, failed, timer = batch
+        for record, error in failed:
+            self.record_failure(record, error)
+        if not prepared:
+            return
+        async with conn.cursor() as cursor:
+            with timer.phase('id_allocation'):
+                ids = await self.take_ids(cursor, prepared)
+
+            try:
+                with timer.phase('pipeline_write', len(prepared)):
+                    await self.send(conn, cursor, prepared, ids, stream_id)
+                committed = len(prepared)
+            except psycopg.Error:
+                await conn.rollback()
+                committed = 0
+                for entry in prepared:
+                    try:
+                        await self.send(conn, cursor, [entry], ids, stream_id)
+                        committed += 1
+                    except psycopg.Error as e:
+                        await conn.rollback()
+                        self.release_slug(entry.slug)
+                        self.record_failure(entry.record, e)
+
+        self.stats['successful_migrations'] += committed
+        timer.emit('batch', records=len(prepared), committed=committed)
+        print(f"Committed {committed} of {len(prepared)} {self.mapping.name}s "
+              f"({self.stats['successful_migrations']} so far)")
+
+    # Function to take an id for every parent and component row of a batch.
+    # Returns {id(entry): (entity id, {spec: [component ids]})}.
+    async def take_ids(self, cursor, prepared):
+        counts = defaultdict(int)
+        counts[self.mapping.table] = len(prepared)
+        for entry in prepared:
+            for spec, rows in entry.components:
+                counts[spec.table] += len(rows)
+        taken = {table: iter(table_ids) for table, table_ids in (await self.id_allocator.take_async(cursor, counts)).items()}
+
+        ids = {}
+        for entry in prepared:
+            entity_id = next(taken[self.mapping.table])
+            ids[id(entry)] = (entity_id, {spec: [next(taken[spec.table]) for _ in rows] for spec, rows in entry.components})
+        return ids
+
+    # Function to send the statements of some prepared records and COMMIT in
+    # one pipeline, waiting only once for all of their results
+    async def send(self, conn, cursor, prepared, ids, stream_id):
+        parents = []
+        stream_links = []
+        components = defaultdict(list)
+        links = []
+        for entry in prepared:
+            entity_id, component_ids = ids[id(entry)]
+            parents.append((entity_id,) + tuple(entry.values))
+            if stream_id is not None:
+                stream_links.append((entity_id, stream_id))
+            for spec, rows in entry.components:
+                for component_id, row in zip(component_ids[spec], rows):
+                    components[spec].append((component_id,) + tuple(row))
+                    links.append((entity_id, component_id, spec.component_type, spec.field))
+
+        async with conn.pipeline():
+            await cursor.executemany(insert_query(self.mapping.table, ('id',) + tuple(self.mapping.columns)), parents)
+            if stream_links:
+                link_table, entity_column, stream_column = self.mapping.stream_link
+                await cursor.executemany(insert_query(
+                    link_table, (entity_column, stream_column),
+                    f" ON CONFLICT ({entity_column}, {stream_column}) DO NOTHING"
+                ), stream_links)
+            for spec, rows in components.items():
+                await cursor.executemany(insert_query(spec.table, ('id',) + tuple(spec.columns)), rows)
+            if links:
+                await cursor.executemany(insert_query(self.mapping.link_table, LINK_COLUMNS), links)
+            await conn.commit()
+
+    def release_slug(self, slug):
+        if self.slug_registry is not None and slug:
+            self.slug_registry.release(slug)
+
+    # Function to record a failed record in the statistics
+    def record_failure(self, record, error):
+        self.stats['failed_migrations'] += 1
+        self.failed_records.append({'title': self.mapping.title(record), 'error': str(error)})
+        print(f"Failed to migrate {self.mapping.title(record)}: {str(error)}")
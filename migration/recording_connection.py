@@ -0,0 +1,160 @@
+import json
+import re
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+
+PLACEHOLDER = re.compile(r'%s')
+INSERT_TABLE = re.compile(r'INSERT\s+INTO\s+(\S+)', re.IGNORECASE)
+# The (table, count) pairs of an IdAllocator reservation
+ID_BLOCK = re.compile(r"\('([^']+)', (\d+)\)")
+
+
+# Function to quote one parameter the way it would travel in the statement
+# text. Close enough to psycopg2's own adaptation for counting bytes.
+def sql_literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    elif hasattr(value, 'adapted'):  # psycopg2.extras.Json
+        value = json.dumps(value.adapted)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# Function to fill the %s placeholders of a query with quoted parameters
+def bind(query, params):
+    literals = iter([sql_literal(value) for value in params])
+    return PLACEHOLDER.sub(lambda _: next(literals), query)
+
+
+# Function to name the kind of a statement by its first keyword, e.g. INSERT
+# or SAVEPOINT. A CTE is named by the statement it wraps.
+def statement_type(query):
+    words = query.split()
+    if not words:
+        return 'EMPTY'
+    if words[0].upper() == 'WITH':
+        for word in words[1:]:
+            if word.upper() in ('INSERT', 'UPDATE', 'DELETE', 'SELECT'):
+                return word.upper()
+    return words[0].upper()
+
+
+# A stand-in for a psycopg2 connection that talks to no server. Every call
+# that would be a round trip is counted per statement type together with the
+# rows and bytes it carries, so a migration can be measured offline and its
+# round trips per exam compared between versions. INSERT ... RETURNING id
+# and IdAllocator reservations hand back increasing ids per table; every
+# other query returns no rows.
+class RecordingConnection:
+    encoding = 'UTF8'  # execute_values encodes queries with this
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_ids = defaultdict(int)
+        self.stats = defaultdict(lambda: {'round_trips': 0, 'rows': 0, 'bytes': 0})
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def record(self, kind, rows, size):
+        with self.lock:
+            entry = self.stats[kind]
+            entry['round_trips'] += 1
+            entry['rows'] += rows
+            entry['bytes'] += size
+
+    def allocate_ids(self, table, count):
+        with self.lock:
+            first = self.next_ids[table] + 1
+            self.next_ids[table] += count
+        return [(entity_id,) for entity_id in range(first, first + count)]
+
+    def commit(self):
+        self.record('COMMIT', 0, len('COMMIT'))
+
+    def rollback(self):
+        self.record('ROLLBACK', 0, len('ROLLBACK'))
+
+    # Function to sum the statistics of every statement type
+    def totals(self):
+        with self.lock:
+            return {
+                key: sum(entry[key] for entry in self.stats.values())
+                for key in ('round_trips', 'rows', 'bytes')
+            }
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    def close(self):
+        pass
+
+
+class RecordingCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.results = []
+        # Rows passed through mogrify since the last execute, which is how
+        # execute_values builds its multi-row VALUES lists
+        self.mogrified_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def mogrify(self, query, params=None):
+        if isinstance(query, bytes):
+            query = query.decode('utf-8')
+        self.mogrified_rows += 1
+        if params:
+            query = bind(query, params)
+        return query.encode('utf-8')
+
+    def execute(self, query, params=None):
+        if isinstance(query, bytes):
+            query = query.decode('utf-8')
+        if params:
+            query = bind(query, params)
+            rows = 1
+        else:
+            rows = self.mogrified_rows
+        self.mogrified_rows = 0
+
+        kind = statement_type(query)
+        self.connection.record(kind, rows, len(query.encode('utf-8')))
+
+        self.results = []
+        table = INSERT_TABLE.search(query)
+        if kind == 'INSERT' and table and query.rstrip().rstrip(';').upper().endswith('RETURNING ID'):
+            self.results = self.connection.allocate_ids(table.group(1), max(rows, 1))
+        elif kind == 'SELECT' and 'pg_get_serial_sequence' in query:
+            for name, count in ID_BLOCK.findall(query):
+                self.results += [(name, entity_id) for (entity_id,) in self.connection.allocate_ids(name, int(count))]
+
+    def fetchone(self):
+        return self.results.pop(0) if self.results else None
+
+    def fetchall(self):
+        results, self.results = self.results, []
+        return results
+
+    # Function to drain a COPY FROM STDIN, counting its lines and bytes
+    def copy_expert(self, sql, file):
+        size = len(sql.encode('utf-8'))
+        lines = 0
+        for line in file:
+            size += len(line.encode('utf-8'))
+            lines += 1
+        self.connection.record('COPY', lines, size)
+
+    def close(self):
+        pass
@@ -0,0 +1,204 @@
+import argparse
+import sys
+import time
+from collections import defaultdict
+import psycopg2
+import MigrateExam2
+from checkpoints import source_id
+from dead_letters import dead_letter, read_dead_letters, rewrite_dead_letters
+from delta import DeltaIndex
+from exam_groups import copy_id
+from id_allocator import BLOCK_SIZE, IdAllocator
+from metrics import MigrationMetrics
+from slug_registry import SlugRegistry
+
+# Loads the exams of a dead-letter file written by MigrateExam2.py
+# --dead-letters again, through the same batched insert path. Exams that fail
+# with a transient error (a dropped connection, a serialization failure, a
+# deadlock) are tried again after a growing pause; exams that fail in their
+# data are not, since they would fail the same way. Whatever still fails is
+# written back to the file with its latest error, so it can be run again.
+# Exams that failed in a --delta run are loaded through the content hashes
+# again, so a changed exam is updated in place and a new one gets its hashes.
+
+
+# Command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate the exams of a dead-letter file again")
+    parser.add_argument('path', help="dead-letter file written by MigrateExam2.py --dead-letters")
+    parser.add_argument('--attempts', type=int, default=5,
+                        help="times to try exams that keep failing with transient errors")
+    parser.add_argument('--backoff', type=float, default=1.0,
+                        help="seconds to wait before the second attempt, doubled before each one after it")
+    parser.add_argument('--commit-every', type=int, default=50,
+                        help="commit after this many exams")
+    parser.add_argument('--id-block-size', type=int, default=BLOCK_SIZE,
+                        help="reserve ids from the sequences this many at a time; 0 waits for RETURNING id instead")
+    return parser.parse_args(argv)
+
+
+# Remembers the exams committed so far in memory, so a later attempt skips them
+class RetryJournal:
+    def __init__(self):
+        self.done_ids = set()
+
+    def is_done(self, record_id):
+        return record_id in self.done_ids
+
+    def stage(self, cursor, record_ids, source_file):
+        pass
+
+    def confirm(self, record_ids):
+        self.done_ids.update(record_ids)
+
+    def close(self):
+        pass
+
+
+# Stands in for ExamGroups: links every exam to the streams its dead letter
+# lists, which already include the other streams of a --merge-streams run
+class DeadLetterStreams:
+    def __init__(self, entries):
+        self.streams = {copy_id(entry['exam']): entry['stream_ids'] for entry in entries}
+
+    def is_chosen(self, exam):
+        return True
+
+    def stream_ids(self, exam, stream_id):
+        return list(self.streams.get(copy_id(exam), [stream_id]))
+
+
+# Collects the exams that fail during one attempt as new dead-letter entries
+class AttemptFailures:
+    def __init__(self):
+        self.entries = {}
+
+    def write(self, json_file, stream_ids, exam, error, phase, record_key=None):
+        self.entries[copy_id(exam)] = dead_letter(json_file, stream_ids, exam, error, phase, record_key)
+
+
+# Migrates the exams of a --delta run under the record keys their dead letters
+# were written with. The stream a retried exam is loaded from need not be the
+# one the key was built from, e.g. with --merge-streams.
+class DeadLetterMigrator(MigrateExam2.ExamMigrator):
+    def __init__(self, *args, record_keys=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.record_keys = record_keys or {}
+
+    def record_key(self, exam, stream_id):
+        return self.record_keys.get(copy_id(exam)) or super().record_key(exam, stream_id)
+
+
+# Function to run one attempt over the given entries, grouped into one job per
+# file so each is written in batches; entries of --delta runs are loaded through
+# delta, the content hashes. Returns the failures of the attempt, the
+# copy ids of the exams whose job ran to the end, each of which was either
+# committed or failed, and the connection error that cut the attempt short,
+# if any.
+def run_attempt(entries, args, slug_registry, journal, metrics, id_allocator, delta):
+    jobs = defaultdict(list)
+    for entry in entries:
+        jobs[(entry.get('delta', False), entry['file'], entry['stream_ids'][0])].append(entry['exam'])
+    record_keys = {copy_id(entry['exam']): entry['record_key'] for entry in entries if entry.get('delta')}
+
+    failures = AttemptFailures()
+    attempted = set()
+    conn = None
+    try:
+        conn = psycopg2.connect(**MigrateExam2.DB_CONFIG)
+        # One migrator per mode, run one after the other on the connection
+        migrators = {}
+        for (is_delta, json_file, stream_id), exams in jobs.items():
+            migrator = migrators.get(is_delta)
+            if migrator is None:
+                migrator = DeadLetterMigrator(conn, slug_registry, args.commit_every, journal=journal,
+                                              delta=delta if is_delta else None, metrics=metrics,
+                                              id_allocator=id_allocator, groups=DeadLetterStreams(entries),
+                                              dead_letters=failures, record_keys=record_keys)
+                migrators[is_delta] = migrator
+            print(f"\nRetrying {len(exams)} exams of {json_file}" + (" by their content hashes" if is_delta else ""))
+            migrator.migrate(exams, json_file, stream_id, 'insert')
+            attempted.update(copy_id(exam) for exam in exams)
+        for migrator in migrators.values():
+            migrator.close()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        # The connection is gone; exams not committed yet are tried again
+        print(f"Attempt cut short: {str(e)}")
+        return failures.entries, attempted, e
+    finally:
+        if conn is not None:
+            conn.close()
+    return failures.entries, attempted, None
+
+def main(argv=None):
+    args = parse_args(argv)
+    entries = read_dead_letters(args.path)
+    if not entries:
+        print(f"No exams in {args.path}")
+        return
+
+    conn = psycopg2.connect(**MigrateExam2.DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            slug_registry = SlugRegistry.load(cursor, 'onlyedudb.exams')
+        conn.commit()
+        # Content hashes of the exams migrated with --delta so far
+        delta = DeltaIndex(conn, 'exam') if any(entry.get('delta') for entry in entries) else None
+    finally:
+        conn.close()
+
+    journal = RetryJournal()
+    metrics = MigrationMetrics()
+    id_allocator = IdAllocator(args.id_block_size) if args.id_block_size > 0 else None
+
+    # Exams that failed in their data and are not tried again
+    permanent = []
+    pending = entries
+    for attempt in range(1, args.attempts + 1):
+        if attempt > 1:
+            delay = args.backoff * 2 ** (attempt - 2)
+            print(f"\nWaiting {delay:.1f}s before attempt {attempt} of {args.attempts}")
+            time.sleep(delay)
+
+        failures, attempted, connection_error = run_attempt(pending, args, slug_registry, journal, metrics,
+                                                            id_allocator, delta)
+
+        retry = []
+        for entry in pending:
+            key = copy_id(entry['exam'])
+            failure = failures.get(key)
+            if failure is None:
+                # Migrated: its job ran to the end without failing it, or the
+                # journal has it. Exams without an exam_id are only known to
+                # be migrated in the first way.
+                if key in attempted or journal.is_done(source_id(entry['exam'])):
+                    continue
+                # Not reached, or its batch not committed, before the connection dropped
+                failure = dict(entry, **dead_letter(entry['file'], entry['stream_ids'], entry['exam'],
+                                                    connection_error, 'connect', entry.get('record_key')))
+            failure['attempts'] = entry.get('attempts', 0) + 1
+            (retry if failure['transient'] else permanent).append(failure)
+        pending = retry
+        if not pending:
+            break
+
+    remaining = permanent + pending
+    rewrite_dead_letters(args.path, remaining)
+
+    print("\nRetry Summary:")
+    print("=" * 50)
+    print(f"Exams retried: {len(entries)}")
+    print(f"Migrated: {len(entries) - len(remaining)}")
+    print(f"Failed in their data: {len(permanent)}")
+    print(f"Still failing with transient errors: {len(pending)}")
+    for entry in remaining:
+        print(f"\nExam: {entry['exam']['exam_name']}")
+        print(f"Phase: {entry['phase']}")
+        print(f"Error: {entry['error_class']}: {entry['error']}")
+    if remaining:
+        print(f"\n{len(remaining)} exams left in {args.path}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
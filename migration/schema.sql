@@ -0,0 +1,129 @@
+-- The onlyedudb tables the migration scripts write to, with the columns they
+-- use. Enough to seed a throwaway database for benchmark.py; the real schema
+-- is owned by the CMS and has more columns.
+
+CREATE SCHEMA IF NOT EXISTS onlyedudb;
+
+CREATE TABLE onlyedudb.exams (
+    id serial PRIMARY KEY,
+    title text,
+    slug text UNIQUE,
+    conducting_body text,
+    accepting_colleges text,
+    total_applications integer,
+    exam_type text,
+    exam_level text,
+    syllabus jsonb,
+    created_at timestamp,
+    updated_at timestamp
+);
+
+CREATE TABLE onlyedudb.exams_stream_links (
+    id serial PRIMARY KEY,
+    exam_id integer,
+    stream_id integer,
+    UNIQUE (exam_id, stream_id)
+);
+
+CREATE TABLE onlyedudb.exams_components (
+    id serial PRIMARY KEY,
+    entity_id integer,
+    component_id integer,
+    component_type text,
+    field text
+);
+CREATE INDEX exams_components_entity_fk ON onlyedudb.exams_components (entity_id);
+
+CREATE TABLE onlyedudb.components_exam_components_exam_highlights_tables (
+    id serial PRIMARY KEY,
+    key text,
+    value text
+);
+
+CREATE TABLE onlyedudb.components_exam_components_faqs (
+    id serial PRIMARY KEY,
+    question text,
+    answer text
+);
+
+CREATE TABLE onlyedudb.components_exam_components_doc_reqs (
+    id serial PRIMARY KEY,
+    title text,
+    content text
+);
+
+CREATE TABLE onlyedudb.components_course_compoents_sections (
+    id serial PRIMARY KEY,
+    title text,
+    content text
+);
+
+CREATE TABLE onlyedudb.coursees (
+    id serial PRIMARY KEY,
+    title text,
+    slug text UNIQUE,
+    average_duration text,
+    average_fees text,
+    description text,
+    created_at timestamp,
+    updated_at timestamp
+);
+
+CREATE TABLE onlyedudb.coursees_components (
+    id serial PRIMARY KEY,
+    entity_id integer,
+    component_id integer,
+    component_type text,
+    field text
+);
+CREATE INDEX coursees_components_entity_fk ON onlyedudb.coursees_components (entity_id);
+
+CREATE TABLE onlyedudb.colleges (
+    id serial PRIMARY KEY,
+    title text,
+    slug text UNIQUE,
+    city text,
+    state text,
+    ownership text,
+    ranking text,
+    rank_publisher text,
+    fees text,
+    accreditation text,
+    avg_package text,
+    exams jsonb,
+    description text,
+    created_at timestamp,
+    updated_at timestamp
+);
+
+CREATE TABLE onlyedudb.colleges_components (
+    id serial PRIMARY KEY,
+    entity_id integer,
+    component_id integer,
+    component_type text,
+    field text
+);
+CREATE INDEX colleges_components_entity_fk ON onlyedudb.colleges_components (entity_id);
+
+CREATE TABLE onlyedudb.components_college_components_courses (
+    id serial PRIMARY KEY,
+    course_title text,
+    fees text,
+    duration text,
+    study_mode text,
+    eligibility text,
+    offered_courses jsonb
+);
+
+CREATE TABLE onlyedudb.components_college_components_tab_sections (
+    id serial PRIMARY KEY,
+    tab text,
+    title text,
+    content text
+);
+
+CREATE TABLE onlyedudb.components_college_components_facilities (
+    id serial PRIMARY KEY,
+    tab text,
+    name text
+);
@@ -0,0 +1,55 @@
+import re
+import threading
+from slugify import slugify
+
+SUFFIX_PATTERN = re.compile(r'^(.*)-(\d+)$')
+
+
+# Hands out unique slugs for one table without a query per candidate. All
+# existing slugs are loaded once; after that the registry remembers every
+# slug in use and the last numeric suffix tried per base slug, so a common
+# title does not walk -1, -2, -3... again on every call. Slugs are only
+# unique among the threads of one process, so only one process at a time
+# should write to a table.
+class SlugRegistry:
+    def __init__(self, table, slugs=()):
+        self.table = table
+        self.taken = set(slugs)
+        self.next_suffix = {}
+        # Shared by all worker threads of one run
+        self.lock = threading.Lock()
+
+    # Function to build a registry from every slug already stored in the table
+    @classmethod
+    def load(cls, cursor, table):
+        cursor.execute(f"SELECT slug FROM {table} WHERE slug IS NOT NULL;")
+        return cls(table, (slug for (slug,) in cursor.fetchall()))
+
+    # Same result as the old check_slug_exists loop: the base slug if free,
+    # otherwise the first free base-1, base-2, ...
+    def generate(self, title):
+        with self.lock:
+            return self._claim(slugify(title))
+
+    # Function to give back a slug whose insert was rolled back
+    def release(self, slug):
+        with self.lock:
+            self.taken.discard(slug)
+            match = SUFFIX_PATTERN.match(slug)
+            if match:
+                base_slug, count = match.group(1), int(match.group(2))
+                if self.next_suffix.get(base_slug, 1) > count:
+                    self.next_suffix[base_slug] = count
+
+    def _claim(self, base_slug):
+        unique_slug = base_slug
+        if unique_slug in self.taken:
+            count = self.next_suffix.get(base_slug, 1)
+            unique_slug = f"{base_slug}-{count}"
+            while unique_slug in self.taken:
+                count += 1
+                unique_slug = f"{base_slug}-{count}"
+            self.next_suffix[base_slug] = count + 1
+
+        self.taken.add(unique_slug)
+        return unique_slug
@@ -0,0 +1,48 @@
+import time
+from contextlib import contextmanager
+
+
+# Decides when a run of exams is committed: after every N exams or after T
+# seconds, whichever comes first. Each exam runs inside its own SAVEPOINT, so
+# a bad exam is rolled back on its own and the rest of the open batch stays.
+class TransactionPolicy:
+    def __init__(self, conn, commit_every=1, commit_seconds=None):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.commit_every = max(commit_every, 1)
+        self.commit_seconds = commit_seconds
+        self.batch_started = None
+
+    # Function to run one exam inside a savepoint. Errors roll back just that
+    # exam's statements and are re-raised for the caller to record.
+    @contextmanager
+    def savepoint(self):
+        if self.batch_started is None:
+            self.batch_started = time.monotonic()
+        self.cursor.execute("SAVEPOINT exam;")
+        try:
+            yield
+        except Exception:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT exam;")
+            raise
+        # Releasing keeps the server from stacking one subtransaction per exam
+        self.cursor.execute("RELEASE SAVEPOINT exam;")
+
+    # Function to tell whether a batch of pending exams should be committed now
+    def due(self, pending):
+        if pending >= self.commit_every:
+            return True
+        if self.commit_seconds is not None and self.batch_started is not None:
+            return time.monotonic() - self.batch_started >= self.commit_seconds
+        return False
+
+    def commit(self):
+        self.conn.commit()
+        self.batch_started = None
+
+    def rollback(self):
+        self.conn.rollback()
+        self.batch_started = None
+
+    def close(self):
+        self.cursor.close()
@@ -0,0 +1,146 @@
+import argparse
+import hashlib
+import sys
+from collections import defaultdict
+import psycopg2
+import MigrateExam2
+from exam_groups import ExamGroups
+from mappings import EXAM_MAPPING
+
+# Reconciles the stream files with what a migration stored, without looking
+# at exams one by one. One streaming pass over the files builds a count and an
+# order-independent checksum per stream and per component field; two
+# aggregate queries build the same from the database.
+# Only the totals that differ are printed.
+#
+# A checksum is the sum of the first 60 bits of the md5 of each row's text:
+# the exam title and the component columns joined with \x1f, NULLs skipped,
+# exactly as concat_ws builds it in SQL. Components are keyed by their exam's
+# title, so a FAQ stored under the wrong exam shows up as well.
+
+
+# Command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the exam stream files with onlyedudb")
+    parser.add_argument('--merge-streams', action='store_true',
+                        help="expect exams listed under several streams to be stored once, as MigrateExam2.py "
+                             "--merge-streams does")
+    return parser.parse_args(argv)
+
+# Function to hash one row the way the SQL side does
+def row_checksum(*values):
+    text = '\x1f'.join(str(value) for value in values if value is not None)
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:15], 16)
+
+# SQL of row_checksum over the given expressions, summed
+def sql_checksum(*expressions):
+    return f"coalesce(sum(('x' || substr(md5(concat_ws(chr(31), {', '.join(expressions)})), 1, 15))::bit(60)::bigint), 0)"
+
+# Function to add one row to a {key: [count, checksum]} total
+def add_row(totals, key, checksum):
+    totals[key][0] += 1
+    totals[key][1] += checksum
+
+# Function to total the stream files: per stream the exams linked to it and
+# per component field the rows stored, as MigrateExam2.py would write them.
+# Returns the two totals and the number of exams that cannot be mapped.
+def source_totals(merge_streams):
+    groups = None
+    if merge_streams:
+        groups = ExamGroups.scan(EXAM_MAPPING, (
+            (stream_id, MigrateExam2.scan_json_file(json_file))
+            for json_file, stream_id in MigrateExam2.STREAM_MAPPINGS.items()
+        ))
+
+    streams = defaultdict(lambda: [0, 0])
+    components = defaultdict(lambda: [0, 0])
+    unmappable = 0
+    for json_file, stream_id in MigrateExam2.STREAM_MAPPINGS.items():
+        for exam in MigrateExam2.scan_json_file(json_file):
+            if groups is not None and not groups.is_chosen(exam):
+                continue
+            try:
+                EXAM_MAPPING.values(exam, None)
+                rows = [(spec, spec.rows(exam)) for spec in EXAM_MAPPING.components]
+            except Exception:
+                # The migration fails these too, so nothing of them is expected
+                unmappable += 1
+                continue
+
+            title = exam['exam_name']
+            linked = groups.stream_ids(exam, stream_id) if groups is not None else [stream_id]
+            for linked_stream_id in linked:
+                add_row(streams, linked_stream_id, row_checksum(title))
+            for spec, spec_rows in rows:
+                for row in spec_rows:
+                    add_row(components, spec.field, row_checksum(title, *row))
+    return streams, components, unmappable
+
+# Function to total the same from the database, for the exams linked to the
+# streams of STREAM_MAPPINGS, in two queries
+def database_totals(cursor):
+    stream_ids = list(MigrateExam2.STREAM_MAPPINGS.values())
+    link_table, entity_column, stream_column = EXAM_MAPPING.stream_link
+
+    cursor.execute(f"""
+    SELECT l.{stream_column}, count(*), {sql_checksum('e.title')}
+    FROM {link_table} l JOIN {EXAM_MAPPING.table} e ON e.id = l.{entity_column}
+    WHERE l.{stream_column} = ANY(%s)
+    GROUP BY l.{stream_column};
+    """, (stream_ids,))
+    streams = {stream_id: [count, int(checksum)] for stream_id, count, checksum in cursor.fetchall()}
+
+    queries = []
+    params = []
+    for spec in EXAM_MAPPING.components:
+        columns = [f"t.{column}" for column in spec.columns]
+        queries.append(f"""
+        SELECT %s AS field, count(*), {sql_checksum('e.title', *columns)}
+        FROM {EXAM_MAPPING.link_table} c
+        JOIN {EXAM_MAPPING.table} e ON e.id = c.entity_id
+        JOIN {spec.table} t ON t.id = c.component_id
+        WHERE c.field = %s AND c.component_type = %s
+        AND c.entity_id IN (SELECT {entity_column} FROM {link_table} WHERE {stream_column} = ANY(%s))
+        """)
+        params += [spec.field, spec.field, spec.component_type, stream_ids]
+    cursor.execute(' UNION ALL '.join(queries) + ';', params)
+    components = {field: [count, int(checksum)] for field, count, checksum in cursor.fetchall()}
+    return streams, components
+
+# Function to print the totals that differ and return how many there are
+def report_mismatches(kind, expected, stored):
+    mismatches = 0
+    for key in sorted(set(expected) | set(stored), key=str):
+        expected_count, expected_checksum = expected.get(key, (0, 0))
+        stored_count, stored_checksum = stored.get(key, (0, 0))
+        if expected_count == stored_count and expected_checksum == stored_checksum:
+            continue
+        mismatches += 1
+        detail = "content differs" if expected_count == stored_count else f"{stored_count - expected_count:+d} rows"
+        print(f"{kind} {key}: expected {expected_count} rows, found {stored_count} ({detail})")
+    return mismatches
+
+def main(argv=None):
+    args = parse_args(argv)
+    expected_streams, expected_components, unmappable = source_totals(args.merge_streams)
+
+    conn = psycopg2.connect(**MigrateExam2.DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            stored_streams, stored_components = database_totals(cursor)
+        conn.rollback()
+    finally:
+        conn.close()
+
+    if unmappable:
+        print(f"{unmappable} source exams cannot be mapped; the migration fails them too, so they are left out")
+    mismatches = (report_mismatches('stream', expected_streams, stored_streams)
+                  + report_mismatches('component', expected_components, stored_components))
+    if mismatches:
+        print(f"{mismatches} totals differ")
+        sys.exit(1)
+    print("Every stream and component total matches the source files")
+
+
+if __name__ == '__main__':
+    main()